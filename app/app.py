@@ -1,8 +1,41 @@
+import asyncio
+import gc
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
 from app.routes import upload, qa, feedback, summarize, retrain, users, guest
+from app.utils.logger import get_logger
+from app.utils.http_client import close_http_client
+from app.services.inference import warm_up_inference_client
+from app.database import embedder, warm_up_vector_store
+from app.config import settings
 
-app = FastAPI(title="LegalDoc AI Backend")
+logger = get_logger()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # uvicorn[standard] should give us uvloop; plain asyncio here means it isn't installed
+    loop_type = type(asyncio.get_running_loop())
+    logger.info(f"Event loop: {loop_type.__module__}.{loop_type.__name__}")
+    if not loop_type.__module__.startswith("uvloop"):
+        logger.warning("uvloop is not in use; install uvicorn[standard] for the faster loop and HTTP parser")
+
+    # Runs in every worker: pay connection setup and the first encode here, not in a user request.
+    # The embedder itself is already warm when EMBEDDING_WARMUP is on (see prepare_embedder).
+    await warm_up_inference_client()
+    if embedder is not None and not settings.EMBEDDING_WARMUP:
+        await asyncio.to_thread(embedder.encode, ["warmup"], show_progress_bar=False)
+    await asyncio.to_thread(warm_up_vector_store)
+    # Per-worker state created since the fork (clients, warmup caches) lives for the
+    # whole process; keep it out of later cyclic-GC passes. The preloaded state is
+    # frozen in the master before forking (see when_ready in gunicorn.conf.py)
+    gc.freeze()
+    yield
+    await close_http_client()
+
+
+app = FastAPI(title="LegalDoc AI Backend", lifespan=lifespan)
 
 @app.get("/", include_in_schema=False)
 async def root_redirect():
@@ -1,28 +1,42 @@
 # app/auth.py
+import asyncio
+import hashlib
+import time
+from cachetools import TTLCache
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from firebase_admin import auth, credentials
-import firebase_admin
-from app.config import settings
+from firebase_admin import auth
+import app.firebase  # noqa: F401  - initialises the default Firebase app
 
 security = HTTPBearer()
 
-if not firebase_admin._apps:
-    try:
-        cred = credentials.Certificate(settings.FIREBASE_KEY_PATH)
-        firebase_admin.initialize_app(cred)
-    except Exception as e:
-        print(f"Failed to initialize Firebase: {e}")
+# Verified ID tokens keyed by a digest of the raw token; entries also carry
+# the token's own expiry so a cached token never outlives its `exp` claim.
+TOKEN_CACHE_TTL_SECONDS = 300
+_token_cache = TTLCache(maxsize=10_000, ttl=TOKEN_CACHE_TTL_SECONDS)
+
+
+def _token_key(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
 
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
     try:
         token = credentials.credentials
-        decoded_token = auth.verify_id_token(token)
+        key = _token_key(token)
+
+        cached = _token_cache.get(key)
+        if cached and cached[1] > time.time():
+            return cached[0]
+
+        decoded_token = await asyncio.to_thread(auth.verify_id_token, token)
+        expires_at = min(time.time() + TOKEN_CACHE_TTL_SECONDS, decoded_token.get("exp", 0))
+        if expires_at > time.time():
+            _token_cache[key] = (decoded_token, expires_at)
         return decoded_token
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Invalid authentication credentials: {e}",
             headers={"WWW-Authenticate": "Bearer"},
-        )
\ No newline at end of file
+        )
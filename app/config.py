@@ -1,4 +1,4 @@
-import os
+from functools import lru_cache
 from typing import Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -26,7 +26,19 @@ class Settings(BaseSettings):
 	# Use cloud if configured, otherwise fallback to local
 	USE_CHROMA_CLOUD: bool = True
 	
+	# One Chroma collection per uploaded file instead of filtering the shared
+	# "legal_chunks" collection by file_hash. Files indexed before enabling this
+	# are still read from (and deleted from) the shared collection.
+	CHROMA_PER_FILE_COLLECTIONS: bool = False
+	
 	EMBEDDING_MODEL_NAME: str = "all-MiniLM-L6-v2"
+	EMBEDDING_BACKEND: str = "torch"  # "torch" | "onnx" | "openvino"
+	# Optional model file for onnx/openvino, e.g. "onnx/model_qint8_avx512.onnx" for INT8
+	EMBEDDING_MODEL_FILE: Optional[str] = None
+	EMBEDDING_FP16: bool = True  # Half precision when a CUDA device is available
+	EMBEDDING_WARMUP: bool = True  # Encode a dummy batch at startup
+	# Set by gunicorn.conf.py: workers place/warm the embedder after fork
+	EMBEDDING_DEFER_DEVICE_PLACEMENT: bool = False
 	UPLOAD_DIR: str = "./uploads"
 	
 	# Text chunking settings
@@ -37,12 +49,30 @@ class Settings(BaseSettings):
 	EMBEDDING_BATCH_SIZE: int = 32
 	VECTOR_DB_BATCH_SIZE: int = 16
 	PDF_PROCESSING_BATCH_SIZE: int = 3
+	INGESTION_WORKERS: int = 1  # Uploads parsed/embedded concurrently per server worker
+	# Processes splitting the pages of large PDFs into chunks; 0 = one per CPU, 1 = in-process.
+	# Splitting costs ~30 µs per page, less than shipping the page to a worker, so
+	# the pool only pays off for unusually dense text.
+	PDF_CHUNK_WORKERS: int = 1
 	# MAX_PDF_PAGES: int = 100  # Removed - now process all pages
 	# MAX_TEXT_PER_PAGE: int = 50000  # Removed - no text limit per page
 	
+	# LLM response cache (per worker process)
+	LLM_CACHE_TTL_SECONDS: int = 86400
+	LLM_CACHE_MAX_ENTRIES: int = 2048
+	# QA only, opt-in: reuse the answer to a near-identical question on the same file.
+	# A hit answers a different question, so keep it off unless that trade-off is acceptable
+	LLM_SEMANTIC_CACHE: bool = False
+	LLM_SEMANTIC_CACHE_THRESHOLD: float = 0.85  # Cosine similarity of the question embeddings
+	
 	# File size limits
 	MAX_FILE_SIZE_MB: int = 50
 	
+	# Dedup hash: "sha256" or "blake3" (needs `pip install blake3`). BLAKE3 keys are
+	# prefixed "b3_", so both kinds of document id can coexist; files uploaded under
+	# the other algorithm just won't be detected as duplicates.
+	FILE_HASH_ALGORITHM: str = "sha256"
+	
 	# Processing settings
 	ENABLE_BACKGROUND_PROCESSING: bool = True
 	ENABLE_DUPLICATE_DETECTION: bool = True
@@ -55,4 +85,9 @@ class Settings(BaseSettings):
 		extra="ignore",  # Ignore extra env vars like HF_API_TOKEN if present
 	)
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+	"""Build Settings (and parse .env) once per process."""
+	return Settings()
+
+settings = get_settings()
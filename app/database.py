@@ -1,96 +1,240 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
 import chromadb
 from chromadb.config import Settings as ChromaSettings
 from app.config import settings
+from app.firebase import firestore_db, SERVER_TIMESTAMP  # Firebase is initialised once, shared with app.auth
 from sentence_transformers import SentenceTransformer
+import torch
 import logging
+import hashlib
 import os
+import threading
+from cachetools import LRUCache
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Firebase init
-try:
-    cred = credentials.Certificate(settings.FIREBASE_KEY_PATH)
-    firebase_admin.initialize_app(cred)
-    firestore_db = firestore.client()
-    logger.info("Firebase initialized successfully")
-except Exception as e:
-    logger.error(f"Firebase initialization failed: {e}")
-    firestore_db = None
+# HNSW settings for newly created collections (existing ones keep theirs).
+# search_ef 128 keeps recall up for the top_k=50 whole-document queries.
+HNSW_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:M": 16,
+    "hnsw:construction_ef": 64,
+    "hnsw:search_ef": 128,
+}
+
+# Per-file collection handles (CHROMA_PER_FILE_COLLECTIONS); resolving one is a round trip on Chroma Cloud
+_file_collections = LRUCache(maxsize=256)
+# Used from the ingestion pool and query threads at once; LRUCache is not thread-safe
+_file_collections_lock = threading.Lock()
 
 # ChromaDB init - Support both local and cloud
-try:
-    if settings.USE_CHROMA_CLOUD and settings.CHROMA_CLOUD_HOST and settings.CHROMA_CLOUD_API_KEY:
-        # Use ChromaDB Cloud with CloudClient
-        logger.info("Initializing ChromaDB Cloud connection...")
-        logger.info(f"Host: {settings.CHROMA_CLOUD_HOST}")
-        logger.info(f"Tenant: {settings.CHROMA_CLOUD_TENANT}")
-        logger.info(f"Database: {settings.CHROMA_CLOUD_DATABASE}")
+def connect_vector_store():
+    """
+    Create the Chroma client and resolve the collection.
+    Called at import, and again in each forked server worker so workers
+    never share the parent's pooled HTTP connections.
+    """
+    global chroma_client, vector_collection
+    # Handles from a previous client are bound to its connection pool
+    with _file_collections_lock:
+        _file_collections.clear()
+    try:
+        if settings.USE_CHROMA_CLOUD and settings.CHROMA_CLOUD_HOST and settings.CHROMA_CLOUD_API_KEY:
+            # Use ChromaDB Cloud with CloudClient
+            logger.info("Initializing ChromaDB Cloud connection...")
+            logger.info(f"Host: {settings.CHROMA_CLOUD_HOST}")
+            logger.info(f"Tenant: {settings.CHROMA_CLOUD_TENANT}")
+            logger.info(f"Database: {settings.CHROMA_CLOUD_DATABASE}")
         
-        # Create cloud client using CloudClient
-        chroma_client = chromadb.CloudClient(
-            api_key=settings.CHROMA_CLOUD_API_KEY,
-            tenant=settings.CHROMA_CLOUD_TENANT if settings.CHROMA_CLOUD_TENANT else None,
-            database=settings.CHROMA_CLOUD_DATABASE if settings.CHROMA_CLOUD_DATABASE else None
-        )
-        logger.info("ChromaDB Cloud client created successfully")
+            # Create cloud client using CloudClient
+            chroma_client = chromadb.CloudClient(
+                api_key=settings.CHROMA_CLOUD_API_KEY,
+                tenant=settings.CHROMA_CLOUD_TENANT if settings.CHROMA_CLOUD_TENANT else None,
+                database=settings.CHROMA_CLOUD_DATABASE if settings.CHROMA_CLOUD_DATABASE else None
+            )
+            logger.info("ChromaDB Cloud client created successfully")
         
-    else:
-        # Use local ChromaDB
-        logger.info("Initializing local ChromaDB...")
+        else:
+            # Use local ChromaDB
+            logger.info("Initializing local ChromaDB...")
         
-        # Ensure local directory exists
-        os.makedirs(settings.CHROMA_DB_DIR, exist_ok=True)
+            # Ensure local directory exists
+            os.makedirs(settings.CHROMA_DB_DIR, exist_ok=True)
         
-        # Create local persistent client
-        chroma_client = chromadb.PersistentClient(path=settings.CHROMA_DB_DIR)
-        logger.info("Local ChromaDB client created successfully")
+            # Create local persistent client
+            chroma_client = chromadb.PersistentClient(path=settings.CHROMA_DB_DIR)
+            logger.info("Local ChromaDB client created successfully")
     
-    # Try to get existing collection or create new one
-    collection_name = "legal_chunks"
+        # Try to get existing collection or create new one
+        collection_name = "legal_chunks"
     
-    # First, try to get the existing collection
-    try:
-        vector_collection = chroma_client.get_collection(name=collection_name)
-        logger.info(f"Using existing ChromaDB collection: {collection_name}")
-        
-        # Verify the collection has data
+        # First, try to get the existing collection
         try:
-            count = vector_collection.count()
-            logger.info(f"Collection contains {count} documents")
+            vector_collection = chroma_client.get_collection(name=collection_name)
+            logger.info(f"Using existing ChromaDB collection: {collection_name}")
+        
+            # Verify the collection has data
+            try:
+                count = vector_collection.count()
+                logger.info(f"Collection contains {count} documents")
             
-            if count == 0:
-                logger.warning("Collection exists but is empty - this might indicate a connection issue")
-            else:
-                logger.info("✅ Collection is properly connected and contains data")
+                if count == 0:
+                    logger.warning("Collection exists but is empty - this might indicate a connection issue")
+                else:
+                    logger.info("✅ Collection is properly connected and contains data")
                 
-        except Exception as e:
-            logger.warning(f"Could not count documents in collection: {e}")
+            except Exception as e:
+                logger.warning(f"Could not count documents in collection: {e}")
             
-    except Exception as e:
-        logger.info(f"Collection '{collection_name}' not found, creating new one: {e}")
+        except Exception as e:
+            logger.info(f"Collection '{collection_name}' not found, creating new one: {e}")
         
-        # Create new collection
-        vector_collection = chroma_client.create_collection(
-            name=collection_name,
-            metadata={"description": "Legal document chunks for RAG"}
-        )
-        logger.info(f"Created new ChromaDB collection: {collection_name}")
+            # Create new collection
+            vector_collection = chroma_client.create_collection(
+                name=collection_name,
+                metadata={"description": "Legal document chunks for RAG", **HNSW_METADATA}
+            )
+            logger.info(f"Created new ChromaDB collection: {collection_name}")
     
-    logger.info("ChromaDB initialized successfully")
+        logger.info("ChromaDB initialized successfully")
     
-except Exception as e:
-    logger.error(f"ChromaDB initialization failed: {e}")
-    logger.error(f"Error type: {type(e).__name__}")
-    vector_collection = None
+    except Exception as e:
+        logger.error(f"ChromaDB initialization failed: {e}")
+        logger.error(f"Error type: {type(e).__name__}")
+        vector_collection = None
+
+chroma_client = None
+vector_collection = None
+connect_vector_store()
+
+def file_collection_name(file_hash: str) -> str:
+    # Chroma names are capped at 63 chars; guest hashes alone are 70
+    return "f_" + hashlib.blake2b(file_hash.encode(), digest_size=24).hexdigest()
+
+def get_file_collection(file_hash: str, create: bool = False):
+    """
+    Return the dedicated collection for one file, or None if it does not exist
+    (and create is False). Only used when CHROMA_PER_FILE_COLLECTIONS is on.
+    """
+    name = file_collection_name(file_hash)
+    with _file_collections_lock:
+        collection = _file_collections.get(name)
+    if collection is not None:
+        return collection
+    try:
+        if create:
+            collection = chroma_client.get_or_create_collection(
+                name=name,
+                metadata={"description": "Legal document chunks for RAG", "file_hash": file_hash, **HNSW_METADATA}
+            )
+        else:
+            collection = chroma_client.get_collection(name=name)
+    except Exception:
+        return None
+    with _file_collections_lock:
+        _file_collections[name] = collection
+    return collection
+
+def warm_up_vector_store(recent_files: int = 16) -> None:
+    """
+    Issue one throwaway query per collection so index loading and connection
+    setup happen before the first request.
+    With per-file collections, the most recently uploaded files are warmed.
+    """
+    collections = [vector_collection] if vector_collection is not None else []
+    if settings.CHROMA_PER_FILE_COLLECTIONS and firestore_db is not None:
+        try:
+            from google.cloud.firestore import Query
+            recent = (
+                firestore_db.collection("documents")
+                .order_by("upload_time", direction=Query.DESCENDING)
+                .limit(recent_files)
+                .stream()
+            )
+            collections += [c for c in (get_file_collection(d.id) for d in recent) if c is not None]
+        except Exception as e:
+            logger.warning(f"Could not list recent files for warmup: {e}")
+    # Same call shape as query_vectors, which queries by our own embeddings
+    query = (
+        {"query_embeddings": embedder.encode(["warmup"], convert_to_numpy=True, show_progress_bar=False)}
+        if embedder is not None else {"query_texts": ["warmup"]}
+    )
+    for collection in collections:
+        try:
+            collection.query(n_results=1, **query)
+        except Exception as e:
+            logger.warning(f"Vector store warmup query failed: {e}")
+    logger.info(f"Vector store warmed up ({len(collections)} collections)")
+
+def delete_file_collection(file_hash: str) -> None:
+    name = file_collection_name(file_hash)
+    with _file_collections_lock:
+        _file_collections.pop(name, None)
+    try:
+        chroma_client.delete_collection(name=name)
+    except Exception:
+        pass  # Never created, e.g. indexed before per-file collections were enabled
+
+def document_is_completed(file_hash: str) -> bool:
+    """True once ingestion has stored every chunk of the file (guest files live in guest_documents)."""
+    if firestore_db is None:
+        return False
+    collection = "guest_documents" if file_hash.startswith("guest_") else "documents"
+    try:
+        snapshot = firestore_db.collection(collection).document(file_hash).get()
+    except Exception as e:
+        logger.warning(f"Could not read processing status for {file_hash}: {e}")
+        return False
+    return snapshot.exists and (snapshot.to_dict() or {}).get("processing_status") == "completed"
 
 # Embedding model
+def prepare_embedder():
+    """
+    Move the embedder to its target device and warm it up.
+    Under a preloading server this must run in each worker after fork,
+    since a CUDA context created in the parent is unusable in children.
+    """
+    if embedder is None:
+        return
+    try:
+        # nn.Module.to()/half() work in place, so modules that imported
+        # `embedder` keep pointing at the moved model
+        if settings.EMBEDDING_BACKEND == "torch" and torch.cuda.is_available():
+            embedder.to("cuda")
+            if settings.EMBEDDING_FP16:
+                embedder.half()
+            logger.info(f"Embedding model moved to CUDA (fp16={settings.EMBEDDING_FP16})")
+
+        # Pay lazy-init costs (kernels, tokenizer caches) before the first request
+        if settings.EMBEDDING_WARMUP:
+            embedder.encode(
+                ["warmup"] * settings.EMBEDDING_BATCH_SIZE,
+                batch_size=settings.EMBEDDING_BATCH_SIZE,
+                show_progress_bar=False,
+            )
+            logger.info("Embedding model warmed up")
+    except Exception as e:
+        logger.error(f"Embedding model preparation failed: {e}")
+
 try:
-    embedder = SentenceTransformer(settings.EMBEDDING_MODEL_NAME)
-    logger.info(f"Embedding model loaded: {settings.EMBEDDING_MODEL_NAME}")
+    # onnx/openvino run the exported (optionally INT8-quantized) graph on CPU
+    # behind the same encode() interface as the torch backend
+    model_kwargs = {"file_name": settings.EMBEDDING_MODEL_FILE} if settings.EMBEDDING_MODEL_FILE else None
+    embedder = SentenceTransformer(
+        settings.EMBEDDING_MODEL_NAME,
+        backend=settings.EMBEDDING_BACKEND,
+        model_kwargs=model_kwargs,
+    )
+    logger.info(f"Embedding model loaded: {settings.EMBEDDING_MODEL_NAME} (backend={settings.EMBEDDING_BACKEND})")
+
+    # Allow TF32 tensor cores for fp32 matmuls
+    torch.set_float32_matmul_precision("high")
 except Exception as e:
     logger.error(f"Embedding model loading failed: {e}")
     embedder = None
+
+# Weights stay in module scope so a preloading parent shares them copy-on-write;
+# device placement is left to the workers when deferred (see gunicorn.conf.py)
+if not settings.EMBEDDING_DEFER_DEVICE_PLACEMENT:
+    prepare_embedder()
@@ -0,0 +1,24 @@
+# app/firebase.py
+import firebase_admin
+from firebase_admin import credentials, firestore
+from app.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Re-exported (via app.database) so callers don't each import firebase_admin.firestore
+SERVER_TIMESTAMP = firestore.SERVER_TIMESTAMP
+
+# Single Firebase Admin initialisation shared by auth and database:
+# the service-account JSON is parsed into one Certificate, exactly once
+try:
+    if firebase_admin._apps:
+        firebase_app = firebase_admin.get_app()
+    else:
+        firebase_app = firebase_admin.initialize_app(credentials.Certificate(settings.FIREBASE_KEY_PATH))
+    firestore_db = firestore.client(firebase_app)
+    logger.info("Firebase initialized successfully")
+except Exception as e:
+    logger.error(f"Firebase initialization failed: {e}")
+    firebase_app = None
+    firestore_db = None
@@ -1,6 +1,9 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional, Dict, Any
 
+# Request bodies are read-only once validated
+REQUEST_MODEL_CONFIG = ConfigDict(frozen=True, extra="ignore")
+
 class UploadResponse(BaseModel):
     file_id: str
     filename: str
@@ -9,6 +12,8 @@ class UploadResponse(BaseModel):
     is_duplicate: Optional[bool] = False
 
 class QARequest(BaseModel):
+    model_config = REQUEST_MODEL_CONFIG
+
     file_hash: str  # Changed from file_id to file_hash for consistency
     question: str
     top_k: Optional[int] = 5
@@ -19,6 +24,8 @@ class QAResponse(BaseModel):
     confidence: float
 
 class FeedbackRequest(BaseModel):
+    model_config = REQUEST_MODEL_CONFIG
+
     file_hash: str  # Changed from file_id to file_hash for consistency
     chunk_id: str
     user_id: Optional[str]
@@ -26,6 +33,8 @@ class FeedbackRequest(BaseModel):
     corrected_output: Optional[str]
 
 class SummarizeRequest(BaseModel):
+    model_config = REQUEST_MODEL_CONFIG
+
     file_hash: str  # Changed from file_id to file_hash for consistency
 
 class UserProfile(BaseModel):
@@ -40,6 +49,8 @@ class UserProfileResponse(BaseModel):
 
 # Authentication models
 class RegisterRequest(BaseModel):
+    model_config = REQUEST_MODEL_CONFIG
+
     email: str
     password: str
     name: Optional[str] = None
@@ -52,6 +63,8 @@ class RegisterResponse(BaseModel):
 
 # Login models
 class LoginRequest(BaseModel):
+    model_config = REQUEST_MODEL_CONFIG
+
     email: str
     password: str
 
@@ -65,6 +78,8 @@ class LoginResponse(BaseModel):
 
 # Google Sign-in models
 class GoogleSignInRequest(BaseModel):
+    model_config = REQUEST_MODEL_CONFIG
+
     id_token: str  # Google ID token
 
 class GoogleSignInResponse(BaseModel):
@@ -75,6 +90,8 @@ class GoogleSignInResponse(BaseModel):
 
 # Advanced feature models
 class CompareRequest(BaseModel):
+    model_config = REQUEST_MODEL_CONFIG
+
     file_hashes: List[str]
     clause_query: str
 
@@ -94,6 +111,8 @@ class EvidenceHighlight(BaseModel):
     highlight_coords: Optional[Dict[str, float]] = None
 
 class HighlightEvidenceRequest(BaseModel):
+    model_config = REQUEST_MODEL_CONFIG
+
     file_hash: str
     question: str
 
@@ -104,6 +123,8 @@ class HighlightEvidenceResponse(BaseModel):
 
 # Guest mode models
 class GuestUploadRequest(BaseModel):
+    model_config = REQUEST_MODEL_CONFIG
+
     filename: str
     file_size: int
 
@@ -116,6 +137,8 @@ class GuestUploadResponse(BaseModel):
 
 # History and chat models
 class ChatHistoryRequest(BaseModel):
+    model_config = REQUEST_MODEL_CONFIG
+
     file_hash: Optional[str] = None
     limit: Optional[int] = 20
 
@@ -124,6 +147,8 @@ class ChatHistoryResponse(BaseModel):
     total_count: int
 
 class ConfidentialReportRequest(BaseModel):
+    model_config = REQUEST_MODEL_CONFIG
+
     file_hash: str
     report_type: str  # "financial", "legal_risks", "compliance"
 
@@ -1,8 +1,8 @@
 from fastapi import APIRouter, Depends
+import asyncio
 from app.models import FeedbackRequest
-from app.database import firestore_db
+from app.database import firestore_db, SERVER_TIMESTAMP
 from app.auth import get_current_user
-import firebase_admin.firestore as firestore
 from app.services.retrain import trigger_retrain_for_user
 
 router = APIRouter()
@@ -18,9 +18,9 @@ async def submit_feedback(
     user_id = current_user.get("uid")
     
     # Add user_id and timestamp to feedback
-    doc = feedback.dict()
+    doc = feedback.model_dump()
     doc["user_id"] = user_id
-    doc["timestamp"] = firestore.SERVER_TIMESTAMP
+    doc["timestamp"] = SERVER_TIMESTAMP
     
     # Optional: Respect confidential flag to exclude from training
     # If client includes {'confidential': true} in feedback, mark it
@@ -28,7 +28,7 @@ async def submit_feedback(
         doc["not_for_training"] = True
     
     # Store feedback in Firestore
-    firestore_db.collection("feedback").add(doc)
+    await asyncio.to_thread(firestore_db.collection("feedback").add, doc)
     
     # Count non-confidential feedback for this user
     feedback_query = (
@@ -36,12 +36,14 @@ async def submit_feedback(
         .where("user_id", "==", user_id)
         .where("not_for_training", "!=", True)
     )
-    count = len(list(feedback_query.stream()))
+    # Server-side aggregation: only the count crosses the wire, not the documents
+    count_result = await asyncio.to_thread(feedback_query.count().get)
+    count = int(count_result[0][0].value)
     
     triggered = False
     if count >= FEEDBACK_THRESHOLD:
         # Trigger background retrain for user
-        trigger_retrain_for_user(user_id)
+        await asyncio.to_thread(trigger_retrain_for_user, user_id)
         triggered = True
     
     return {
@@ -1,16 +1,40 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
+from fastapi.responses import ORJSONResponse
 from app.models import QARequest, QAResponse
-from app.services.embedding import query_vectors
-from app.services.inference import call_hf_inference, build_rag_prompt
-from app.database import firestore_db
+from app.services.embedding import aquery_vectors
+from app.services.prompts import build_rag_prompt
+from app.services.llm_cache import cached_inference
+from app.services.rag import build_evidence
+from app.database import firestore_db, SERVER_TIMESTAMP
 from app.auth import get_current_user
-import firebase_admin.firestore as firestore
+from app.services.ownership import verify_owner
+from app.utils.coalescer import RequestCoalescer
 
 router = APIRouter()
 
+QA_RESULT_TTL_SECONDS = 60  # Repeats within this window reuse the previous answer
+
+# Failed LLM calls come back with zero confidence and are not kept
+_qa_coalescer = RequestCoalescer(ttl=QA_RESULT_TTL_SECONDS, cacheable=lambda result: result[2] > 0)
+
+async def _answer_question(file_hash: str, question: str, top_k: int):
+    """Retrieve evidence for a question and generate the answer."""
+    # Query vectors using file_hash
+    res = await aquery_vectors(question, file_id=file_hash, top_k=top_k)
+    
+    if not res["documents"] or not res["documents"][0]:
+        raise HTTPException(404, "No relevant documents found for this file")
+    
+    docs, snippets = build_evidence(res)
+
+    prompt = build_rag_prompt(question, snippets)
+    answer, conf = await cached_inference(prompt, semantic_scope=(file_hash, top_k), semantic_text=question)
+    return docs, answer, conf
+
 @router.post("/qa", response_model=QAResponse)
 async def query_legal_doc(
     req: QARequest,
+    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_user)
 ):
     if not req.file_hash:
@@ -18,41 +42,24 @@ async def query_legal_doc(
     
     # Verify document ownership
     user_id = current_user.get("uid")
-    doc_ref = firestore_db.collection("documents").document(req.file_hash)
-    doc = doc_ref.get()
-    if (not doc.exists) or (doc.to_dict().get("owner_id") != user_id):
-        raise HTTPException(status_code=404, detail="File not found or access denied.")
-    
-    # Query vectors using file_hash
-    res = query_vectors(req.question, file_id=req.file_hash, top_k=req.top_k)
-    
-    if not res["documents"] or not res["documents"][0]:
-        raise HTTPException(404, "No relevant documents found for this file")
+    await verify_owner(req.file_hash, user_id, detail="File not found or access denied.")
     
-    docs = []
-    snippets = []
-    
-    # Safely iterate over results
-    for i in range(len(res["documents"][0])):
-        doc_id = res["ids"][0][i] if res["ids"] and res["ids"][0] else f"doc_{i}"
-        doc_text = res["documents"][0][i] if res["documents"] and res["documents"][0] else ""
-        meta = res["metadatas"][0][i] if res["metadatas"] and res["metadatas"][0] else {}
-        score = res["distances"][0][i] if res["distances"] and res["distances"][0] else 0.0
-        
-        docs.append({"chunk_id": doc_id, "text": doc_text, "meta": meta, "score": score})
-        snippets.append(doc_text)
-
-    prompt = build_rag_prompt(req.question, snippets)
-    answer, conf = call_hf_inference(prompt)
-
-    # Save to history
-    firestore_db.collection("history").add({
+    # Identical concurrent questions on a file share one retrieval + LLM call
+    key = _qa_coalescer.make_key(req.file_hash, req.question, req.top_k)
+    docs, answer, conf = await _qa_coalescer.run(
+        key, lambda: _answer_question(req.file_hash, req.question, req.top_k)
+    )
+
+    # Save to history after the response is sent
+    background_tasks.add_task(firestore_db.collection("history").add, {
         "user_id": user_id,
         "file_hash": req.file_hash,
         "question": req.question,
         "answer": answer,
         "confidence": conf,
-        "timestamp": firestore.SERVER_TIMESTAMP,
+        "timestamp": SERVER_TIMESTAMP,
     })
 
-    return QAResponse(answer=answer, evidence=docs, confidence=conf)
+    # QAResponse documents the schema; the payload is already plain JSON types, so
+    # return it directly instead of building the model and re-validating it
+    return ORJSONResponse({"answer": answer, "evidence": docs, "confidence": conf})
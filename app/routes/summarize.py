@@ -3,12 +3,15 @@ from app.models import (
     SummarizeRequest, CompareRequest, CompareResponse, 
     SimplifyResponse, HighlightEvidenceRequest, HighlightEvidenceResponse
 )
-from app.services.embedding import query_vectors
-from app.services.inference import call_hf_inference
+from app.services.embedding import aquery_vectors, aget_document_text
+from app.services.llm_cache import cached_inference
+from app.services.prompts import build_simplify_prompt, build_compare_prompt
+from app.services.summary import get_or_create_summary, get_stored_summary
 from app.auth import get_current_user
+from app.services.ownership import verify_owner, verify_owners, remember_owner
 from app.database import firestore_db
 from typing import List, Dict, Any
-import firebase_admin.firestore as firestore
+import asyncio
 
 router = APIRouter()
 
@@ -20,43 +23,17 @@ async def summarize_contract(
     """Summarize a legal document with ownership verification."""
     user_id = current_user.get("uid")
     
-    # Verify document ownership
-    doc_ref = firestore_db.collection("documents").document(req.file_hash)
-    doc = doc_ref.get()
-    if not doc.exists:
-        raise HTTPException(status_code=404, detail="Document not found")
-    
-    doc_data = doc.to_dict()
-    owner_id = doc_data.get("owner_id")
-    
-    # If no owner_id is set (old documents), allow access but log it
-    if owner_id and owner_id != user_id:
-        raise HTTPException(status_code=404, detail="Document not found or access denied.")
-    
-    # Get document chunks
-    res = query_vectors("", file_id=req.file_hash, top_k=20)  # Get more chunks for better summary
-    docs = res.get("documents", [[]])
-    if not docs or not docs[0]:
+    # Ownership check and stored-summary read overlap; a missing summary is only
+    # generated once ownership passes. No owner_id (old documents) is allowed.
+    _, result = await asyncio.gather(
+        verify_owner(req.file_hash, user_id, allow_unowned=True),
+        get_stored_summary(req.file_hash),
+    )
+    if result is None:
+        result = await get_or_create_summary(req.file_hash)
+    if result is None:
         raise HTTPException(404, "Document not found")
-    
-    # Join all chunks for comprehensive summary
-    joined_text = "\n\n".join(docs[0])
-    prompt = f"""Analyze the following legal document and provide a comprehensive summary:
-
-{joined_text}
-
-Please provide a structured summary with:
-1. Document Type and Purpose
-2. Key Parties Involved
-3. Main Terms and Conditions
-4. Important Deadlines or Dates
-5. Financial Obligations
-6. Termination Conditions
-
-Summary:"""
-    
-    answer, confidence = call_hf_inference(prompt)
-    return {"summary": answer, "confidence": confidence}
+    return result
 
 @router.post("/simplify", response_model=SimplifyResponse)
 async def simplify_document(
@@ -66,44 +43,17 @@ async def simplify_document(
     """Transform legal document into plain English with structured breakdown."""
     user_id = current_user.get("uid")
     
-    # Verify document ownership
-    doc_ref = firestore_db.collection("documents").document(req.file_hash)
-    doc = doc_ref.get()
-    if not doc.exists or doc.to_dict().get("owner_id") != user_id:
-        raise HTTPException(status_code=404, detail="Document not found or access denied.")
-    
-    # Get all document chunks
-    res = query_vectors("", file_id=req.file_hash, top_k=50)  # Get all chunks
-    docs = res.get("documents", [[]])
-    if not docs or not docs[0]:
+    # Ownership check and chunk fetch overlap; chunks are only used once ownership passes
+    _, full_text = await asyncio.gather(
+        verify_owner(req.file_hash, user_id),
+        aget_document_text(req.file_hash, max_chunks=50),
+    )
+    if not full_text:
         raise HTTPException(404, "Document not found")
     
-    # Join all chunks
-    full_text = "\n\n".join(docs[0])
-    
-    prompt = f"""Analyze the entire legal document provided below. Your task is to "translate" it into plain English. Create a structured summary with the following markdown sections:
-
-### 🔑 Key Terms
-(Define important terms like 'Lessee', 'Force Majeure', etc.)
-
-### ✅ Your Obligations
-(A bulleted list of everything the user MUST do.)
-
-### ⚠️ Potential Risks & Red Flags
-(A bulleted list of penalties, auto-renewals, or unfair terms.)
-
-### 📈 Financial Summary
-(List all costs, deposits, and fees mentioned.)
-
-### 📅 Important Dates
-(All deadlines, renewal dates, and time-sensitive items.)
-
-Document Text:
-{full_text}
-
-Structured Analysis:"""
+    prompt = build_simplify_prompt(full_text)
     
-    answer, confidence = call_hf_inference(prompt)
+    answer, confidence = await cached_inference(prompt)
     return SimplifyResponse(simplified=answer, confidence=confidence)
 
 @router.post("/compare", response_model=CompareResponse)
@@ -122,17 +72,14 @@ async def compare_clauses(
     if not clause_query:
         raise HTTPException(400, "Clause query is required")
     
-    # Verify ownership of all documents
-    for file_hash in file_hashes:
-        doc_ref = firestore_db.collection("documents").document(file_hash)
-        doc = doc_ref.get()
-        if not doc.exists or doc.to_dict().get("owner_id") != user_id:
-            raise HTTPException(status_code=404, detail=f"Document {file_hash} not found or access denied.")
-    
-    # Get relevant chunks from each document
+    # Ownership of all documents (cache misses in one batched read) is checked while
+    # the relevant chunks are retrieved; chunks are only used once ownership passes
+    _, *results = await asyncio.gather(
+        verify_owners(file_hashes, user_id),
+        *(aquery_vectors(clause_query, file_id=file_hash, top_k=5) for file_hash in file_hashes),
+    )
     document_texts = []
-    for i, file_hash in enumerate(file_hashes):
-        res = query_vectors(clause_query, file_id=file_hash, top_k=5)
+    for i, res in enumerate(results):
         docs = res.get("documents", [[]])
         if docs and docs[0]:
             doc_text = "\n\n".join(docs[0])
@@ -143,19 +90,9 @@ async def compare_clauses(
     
     # Build comparison prompt
     comparison_text = "\n\n".join(document_texts)
-    prompt = f"""You are a legal analyst. Compare and contrast the following clauses from different documents. Explain the key differences in simple terms.
-
-Query: "{clause_query}"
-
-{comparison_text}
-
-Comparison Analysis:
-### Key Similarities
-### Key Differences
-### Recommendations
-### Risk Assessment"""
+    prompt = build_compare_prompt(clause_query, comparison_text)
     
-    answer, confidence = call_hf_inference(prompt)
+    answer, confidence = await cached_inference(prompt)
     return CompareResponse(comparison=answer, confidence=confidence)
 
 @router.post("/highlight-evidence", response_model=HighlightEvidenceResponse)
@@ -169,31 +106,29 @@ async def get_evidence_highlights(
     question = req.question
     
     # Verify document ownership
-    doc_ref = firestore_db.collection("documents").document(file_hash)
-    doc = doc_ref.get()
-    if not doc.exists or doc.to_dict().get("owner_id") != user_id:
-        raise HTTPException(status_code=404, detail="Document not found or access denied.")
+    await verify_owner(file_hash, user_id)
     
     # Get relevant chunks with metadata
-    res = query_vectors(question, file_id=file_hash, top_k=5)
+    res = await aquery_vectors(question, file_id=file_hash, top_k=5)
     
     if not res.get("documents") or not res["documents"][0]:
         raise HTTPException(404, "No relevant evidence found")
     
-    # Format evidence with highlighting info
-    evidence = []
-    for i in range(len(res["documents"][0])):
-        doc_text = res["documents"][0][i]
-        metadata = res["metadatas"][0][i] if res["metadatas"] and res["metadatas"][0] else {}
-        score = res["distances"][0][i] if res["distances"] and res["distances"][0] else 0.0
-        
-        evidence.append({
+    # Format evidence with highlighting info; optional lists are checked once, not per chunk
+    texts = res["documents"][0]
+    n = len(texts)
+    metas = res["metadatas"][0] if res.get("metadatas") and res["metadatas"][0] else [{}] * n
+    scores = res["distances"][0] if res.get("distances") and res["distances"][0] else [0.0] * n
+    evidence = [
+        {
             "text": doc_text,
-            "page": metadata.get("page", 1),
-            "chunk_index": metadata.get("chunk_index", i),
+            "page": meta.get("page", 1),
+            "chunk_index": meta.get("chunk_index", i),
             "score": score,
-            "highlight_coords": metadata.get("bbox", None)  # For future PDF highlighting
-        })
+            "highlight_coords": meta.get("bbox", None)  # For future PDF highlighting
+        }
+        for i, (doc_text, meta, score) in enumerate(zip(texts, metas, scores))
+    ]
     
     return HighlightEvidenceResponse(
         evidence=evidence,
@@ -219,5 +154,6 @@ async def fix_document_ownership(
     
     # Update the document with owner_id
     doc_ref.update({"owner_id": user_id})
+    remember_owner(req.file_hash, user_id)
     
     return {"message": f"Document {req.file_hash} ownership fixed for user {user_id}"}
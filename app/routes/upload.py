@@ -1,15 +1,17 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks, Depends
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
 from app.services.pdf_parser import pdf_parser
-from app.services.embedding import embedding_service
-from app.database import firestore_db, vector_collection, embedder
+from app.services.embedding import delete_file_vectors
+from app.services.ingestion import submit_pdf_job
+from app.services.summary import delete_summary
+from app.database import firestore_db, vector_collection, embedder, SERVER_TIMESTAMP
 import os
-import firebase_admin.firestore as firestore
 import asyncio
 from typing import Optional
-import gc
 
 from app.config import settings
+from app.utils.fileops import FileTooLargeError, stream_upload_to_disk, temp_upload_path
 from app.auth import get_current_user
+from app.services.ownership import get_owned_document, remember_owner, forget_owner
 from app.models import UploadResponse
 
 router = APIRouter()
@@ -22,79 +24,27 @@ async def check_duplicate_file(file_hash: str) -> Optional[dict]:
         if not firestore_db:
             return None
         
-        # Check documents collection for existing hash
-        docs_ref = firestore_db.collection("documents")
-        query = docs_ref.where("file_hash", "==", file_hash).limit(1)
-        docs = query.stream()
-        
-        for doc in docs:
-            return {
-                "exists": True,
-                "file_id": doc.id,
-                "filename": doc.get("filename"),
-                "upload_time": doc.get("upload_time")
-            }
+        # Documents are stored under their hash, so this is a point read, not a query
+        doc = await asyncio.to_thread(firestore_db.collection("documents").document(file_hash).get)
+        if not doc.exists:
+            return {"exists": False}
         
-        return {"exists": False}
+        data = doc.to_dict()
+        remember_owner(file_hash, data.get("owner_id"))
+        return {
+            "exists": True,
+            "file_id": doc.id,
+            "filename": data.get("filename"),
+            "upload_time": data.get("upload_time")
+        }
         
     except Exception as e:
         print(f"Error checking duplicate: {e}")
         return None
 
-async def process_pdf_background(file_hash: str, file_content: bytes, original_filename: str):
-    """
-    Background task to process PDF and store in vector database.
-    This prevents blocking the upload response.
-    """
-    try:
-        print(f"Starting background processing for file: {original_filename}")
-        
-        # Process PDF in batches
-        result = pdf_parser.process_pdf_in_batches(file_content, batch_size=3)
-        
-        if "error" in result:
-            print(f"Error processing PDF: {result['error']}")
-            return
-        
-        # Store chunks in vector database
-        if result["chunks"]:
-            success = embedding_service.process_and_store_chunks(result["chunks"])
-            if success:
-                print(f"Successfully processed {len(result['chunks'])} chunks for {original_filename}")
-            else:
-                print(f"Failed to store chunks for {original_filename}")
-        
-        # Update document status in Firestore
-        if firestore_db:
-            try:
-                firestore_db.collection("documents").document(file_hash).update({
-                    "processing_status": "completed",
-                    "total_chunks": result.get("total_chunks", 0),
-                    "processing_completed": firestore.SERVER_TIMESTAMP
-                })
-            except Exception as e:
-                print(f"Error updating document status: {e}")
-        
-        # Clean up
-        del file_content, result
-        gc.collect()
-        
-    except Exception as e:
-        print(f"Background processing error for {original_filename}: {e}")
-        # Update status to failed
-        if firestore_db:
-            try:
-                firestore_db.collection("documents").document(file_hash).update({
-                    "processing_status": "failed",
-                    "error": str(e)
-                })
-            except Exception as update_error:
-                print(f"Error updating failed status: {update_error}")
-
 @router.post("/upload", response_model=UploadResponse)
 async def upload_pdf(
     file: UploadFile = File(...),
-    background_tasks: BackgroundTasks = None,
     current_user: dict = Depends(get_current_user)
 ):
     try:
@@ -109,19 +59,19 @@ async def upload_pdf(
         if not file.filename.lower().endswith(".pdf"):
             raise HTTPException(400, "Only PDFs are supported")
         
-        # Read file content
-        content = await file.read()
-        
-        # Check file size to prevent memory issues
-        if len(content) > 50 * 1024 * 1024:  # 50MB limit
-            raise HTTPException(400, "File too large. Maximum size is 50MB.")
-        
-        # Calculate file hash for duplicate detection
-        file_hash = pdf_parser.calculate_file_hash(content)
+        # Stream the body to a scratch file while hashing it; it is never held in memory
+        temp_path = temp_upload_path()
+        try:
+            file_hash, file_size = await stream_upload_to_disk(
+                file, temp_path, max_bytes=settings.MAX_FILE_SIZE_MB * 1024 * 1024
+            )
+        except FileTooLargeError:
+            raise HTTPException(400, f"File too large. Maximum size is {settings.MAX_FILE_SIZE_MB}MB.")
         
-        # Check for duplicate files
+        # Check for duplicate files before anything is parsed
         duplicate_check = await check_duplicate_file(file_hash)
         if duplicate_check and duplicate_check.get("exists"):
+            os.remove(temp_path)
             existing_file = duplicate_check
             return UploadResponse(
                 file_id=existing_file["file_id"],
@@ -131,52 +81,37 @@ async def upload_pdf(
                 is_duplicate=True
             )
         
-        # Create upload directory if it doesn't exist
-        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
-        
-        # Save file with hash-based name for consistency
+        # Move the upload to its hash-based name for consistency
         file_extension = os.path.splitext(file.filename)[1]
         file_path = os.path.join(settings.UPLOAD_DIR, f"{file_hash}{file_extension}")
+        os.replace(temp_path, file_path)
         
-        # Save file content
-        with open(file_path, "wb") as f:
-            f.write(content)
-        
-        # Get basic file info for immediate response
-        basic_info = pdf_parser.extract_text_from_pdf_bytes(content, max_pages=None)  # Process ALL pages
+        # Page count for the immediate response; text extraction happens in the background
+        pages = await asyncio.to_thread(pdf_parser.get_page_count, file_path)
         
         # Save initial document metadata
         doc_data = {
             "filename": file.filename,
             "file_hash": file_hash,
             "file_path": file_path,
-            "file_size": len(content),
-            "pages": basic_info.get("total_pages", 0),
-            "upload_time": firestore.SERVER_TIMESTAMP,
+            "file_size": file_size,
+            "pages": pages,
+            "upload_time": SERVER_TIMESTAMP,
             "processing_status": "processing",
             "original_filename": file.filename,
             "owner_id": current_user.get("uid")
         }
         
-        firestore_db.collection("documents").document(file_hash).set(doc_data)
+        await asyncio.to_thread(firestore_db.collection("documents").document(file_hash).set, doc_data)
+        remember_owner(file_hash, doc_data["owner_id"])
         
-        # Start background processing
-        if background_tasks:
-            background_tasks.add_task(
-                process_pdf_background,
-                file_hash,
-                content,
-                file.filename
-            )
-        
-        # Clean up content from memory
-        del content
-        gc.collect()
+        # Queue parsing/embedding on the ingestion pool, off the event loop
+        submit_pdf_job("documents", file_hash, file_path, file.filename)
         
         return UploadResponse(
             file_id=file_hash,
             filename=file.filename,
-            pages=basic_info.get("total_pages", 0),
+            pages=pages,
             message="File uploaded successfully. Processing in background.",
             is_duplicate=False
         )
@@ -185,8 +120,9 @@ async def upload_pdf(
         raise
     except Exception as e:
         # Clean up on any unexpected error
-        if 'file_path' in locals() and os.path.exists(file_path):
-            os.remove(file_path)
+        for path in (locals().get('temp_path'), locals().get('file_path')):
+            if path and os.path.exists(path):
+                os.remove(path)
         raise HTTPException(500, f"Upload failed: {str(e)}")
 
 @router.get("/upload/status/{file_hash}")
@@ -198,16 +134,7 @@ async def get_upload_status(file_hash: str, current_user: dict = Depends(get_cur
         if not firestore_db:
             raise HTTPException(500, "Database not available")
         
-        doc_ref = firestore_db.collection("documents").document(file_hash)
-        doc = doc_ref.get()
-        
-        if not doc.exists:
-            raise HTTPException(404, "File not found")
-        
-        data = doc.to_dict()
-        # Enforce ownership
-        if data.get("owner_id") != current_user.get("uid"):
-            raise HTTPException(404, "File not found")
+        data = await get_owned_document(file_hash, current_user.get("uid"), detail="File not found")
         return {
             "file_hash": file_hash,
             "filename": data.get("filename"),
@@ -233,27 +160,23 @@ async def delete_file(file_hash: str, current_user: dict = Depends(get_current_u
             raise HTTPException(500, "Database not available")
         
         # Get file info
-        doc_ref = firestore_db.collection("documents").document(file_hash)
-        doc = doc_ref.get()
-        
-        if not doc.exists:
-            raise HTTPException(404, "File not found")
-        
-        data = doc.to_dict()
-        # Enforce ownership
-        if data.get("owner_id") != current_user.get("uid"):
-            raise HTTPException(404, "File not found")
+        data = await get_owned_document(file_hash, current_user.get("uid"), detail="File not found")
         file_path = data.get("file_path")
         
         # Delete file from disk
         if file_path and os.path.exists(file_path):
-            os.remove(file_path)
-        
-        # Delete from vector database (this would need to be implemented)
-        # For now, just delete from Firestore
-        
-        # Delete document
-        doc_ref.delete()
+            await asyncio.to_thread(os.remove, file_path)
+        
+        # Delete from vector database
+        try:
+            await asyncio.to_thread(delete_file_vectors, file_hash)
+        except Exception as e:
+            print(f"Error deleting vectors for {file_hash}: {e}")
+        
+        # Delete document and its cached summary
+        await asyncio.to_thread(firestore_db.collection("documents").document(file_hash).delete)
+        forget_owner(file_hash)
+        await asyncio.to_thread(delete_summary, file_hash)
         
         return {"message": "File deleted successfully"}
         
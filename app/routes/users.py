@@ -1,28 +1,36 @@
 # app/routes/users.py
-from fastapi import APIRouter, Depends, HTTPException
-from app.database import firestore_db
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from app.database import firestore_db, SERVER_TIMESTAMP
 from app.auth import get_current_user
+from app.services.ownership import verify_owner
 from firebase_admin import auth as fb_auth
 from app.models import (
     RegisterRequest, RegisterResponse, LoginRequest, LoginResponse,
     GoogleSignInRequest, GoogleSignInResponse, ChatHistoryRequest, 
     ChatHistoryResponse, ConfidentialReportRequest, ConfidentialReportResponse
 )
+import asyncio
 import datetime
+import heapq
+import logging
 import os
-import requests
-from app.services.inference import call_hf_inference
+from app.services.inference import acall_hf_inference
+from app.services.prompts import REPORT_PROMPTS, build_report_prompt
+from app.services.embedding import aget_document_text
+from app.config import settings
+from app.utils.http_client import get_http_client
 import firebase_admin.firestore as firestore
 from google.api_core.exceptions import FailedPrecondition
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 @router.get("/users/profile", tags=["Users"])
 async def get_user_profile(current_user: dict = Depends(get_current_user)):
     """Return the authenticated user's profile details."""
     user_id = current_user.get("uid")
     user_ref = firestore_db.collection("users").document(user_id)
-    snapshot = user_ref.get()
+    snapshot = await asyncio.to_thread(user_ref.get)
 
     if snapshot.exists:
         data = snapshot.to_dict()
@@ -42,7 +50,7 @@ async def get_user_profile(current_user: dict = Depends(get_current_user)):
 async def register_user(payload: RegisterRequest):
     """Register a new user via Firebase Auth and create a profile in Firestore."""
     try:
-        user_record = fb_auth.create_user(email=payload.email, password=payload.password)
+        user_record = await asyncio.to_thread(fb_auth.create_user, email=payload.email, password=payload.password)
         uid = user_record.uid
 
         user_doc = {
@@ -51,7 +59,7 @@ async def register_user(payload: RegisterRequest):
             "name": payload.name,
             "created_at": datetime.datetime.utcnow().isoformat(),
         }
-        firestore_db.collection("users").document(uid).set(user_doc)
+        await asyncio.to_thread(firestore_db.collection("users").document(uid).set, user_doc)
 
         return RegisterResponse(uid=uid, email=payload.email, name=payload.name, message="User registered successfully")
     except Exception as e:
@@ -61,13 +69,12 @@ async def register_user(payload: RegisterRequest):
 async def login_user(payload: LoginRequest):
     """Sign in a user using Firebase Identity Toolkit REST API and return ID token."""
     try:
-        from app.config import settings
         api_key = os.getenv("FIREBASE_WEB_API_KEY") or getattr(settings, "FIREBASE_WEB_API_KEY", None)
         if not api_key:
             raise RuntimeError("FIREBASE_WEB_API_KEY is not configured")
 
         url = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={api_key}"
-        resp = requests.post(url, json={
+        resp = await get_http_client().post(url, json={
             "email": payload.email,
             "password": payload.password,
             "returnSecureToken": True
@@ -95,13 +102,14 @@ async def login_user(payload: LoginRequest):
 async def google_signin(payload: GoogleSignInRequest):
     """Sign in a user using Google ID token."""
     try:
-        decoded_token = fb_auth.verify_id_token(payload.id_token)
+        decoded_token = await asyncio.to_thread(fb_auth.verify_id_token, payload.id_token)
         uid = decoded_token.get("uid")
         email = decoded_token.get("email")
         name = decoded_token.get("name")
 
         user_ref = firestore_db.collection("users").document(uid)
-        if not user_ref.get().exists:
+        snapshot = await asyncio.to_thread(user_ref.get)
+        if not snapshot.exists:
             user_doc = {
                 "uid": uid,
                 "email": email,
@@ -109,9 +117,9 @@ async def google_signin(payload: GoogleSignInRequest):
                 "created_at": datetime.datetime.utcnow().isoformat(),
                 "auth_provider": "google"
             }
-            user_ref.set(user_doc)
+            await asyncio.to_thread(user_ref.set, user_doc)
         else:
-            user_ref.update({
+            await asyncio.to_thread(user_ref.update, {
                 "last_login": datetime.datetime.utcnow().isoformat(),
                 "auth_provider": "google"
             })
@@ -130,7 +138,8 @@ async def create_user_profile(current_user: dict = Depends(get_current_user)):
     user_id = current_user.get("uid")
     user_ref = firestore_db.collection("users").document(user_id)
 
-    if user_ref.get().exists:
+    snapshot = await asyncio.to_thread(user_ref.get)
+    if snapshot.exists:
         return {"status": "success", "message": "User profile already exists."}
 
     user_data = {
@@ -139,9 +148,24 @@ async def create_user_profile(current_user: dict = Depends(get_current_user)):
         "name": current_user.get("name"),
         "created_at": datetime.datetime.utcnow().isoformat()
     }
-    user_ref.set(user_data)
+    await asyncio.to_thread(user_ref.set, user_data)
     return {"status": "success", "message": "User profile created.", "user": user_data}
 
+# Firestore timestamps are timezone-aware; history rows without one sort last
+_EPOCH_UTC = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+_history_index_warned = False
+HISTORY_FALLBACK_SCAN_LIMIT = 500  # Most documents the unindexed fallback reads per request
+
+def _warn_missing_history_index(error: Exception) -> None:
+    """Log the index-creation link from Firestore once per process."""
+    global _history_index_warned
+    if not _history_index_warned:
+        _history_index_warned = True
+        logger.warning(
+            f"Chat history is using the unindexed fallback (at most {HISTORY_FALLBACK_SCAN_LIMIT} "
+            f"documents scanned, so results may be incomplete); deploy firestore.indexes.json: {error}"
+        )
+
 @router.get("/users/chat-history", response_model=ChatHistoryResponse, tags=["Users"])
 async def get_chat_history(
     req: ChatHistoryRequest = Depends(),
@@ -155,119 +179,68 @@ async def get_chat_history(
         if req.file_hash:
             query = query.where("file_hash", "==", req.file_hash)
         query = query.order_by("timestamp", direction=firestore.Query.DESCENDING)
-        docs = list(query.limit(req.limit).stream())
-    except FailedPrecondition:
-        # Missing composite index; fallback to basic fetch and local filter/sort
+        docs = await asyncio.to_thread(lambda: list(query.limit(req.limit).stream()))
+    except FailedPrecondition as e:
+        # Missing composite index (see firestore.indexes.json). Equality filters alone
+        # need no composite index, so filter server-side and only sort locally; the
+        # scan is capped so a user with a long history cannot make this unbounded.
+        _warn_missing_history_index(e)
         base = firestore_db.collection("history").where("user_id", "==", user_id)
-        docs_stream = base.stream()
-        items = []
-        for d in docs_stream:
-            data = d.to_dict()
-            if req.file_hash and data.get("file_hash") != req.file_hash:
-                continue
-            items.append((d.id, data))
-        # Sort locally by timestamp desc
-        items.sort(key=lambda x: x[1].get("timestamp", datetime.datetime.min), reverse=True)
-        items = items[: req.limit]
-        docs = items
+        if req.file_hash:
+            base = base.where("file_hash", "==", req.file_hash)
+        base = base.limit(HISTORY_FALLBACK_SCAN_LIMIT)
+        docs_stream = await asyncio.to_thread(lambda: list(base.stream()))
+        docs = heapq.nlargest(
+            req.limit, docs_stream,
+            key=lambda d: (d.to_dict() or {}).get("timestamp") or _EPOCH_UTC
+        )
 
     history = []
-    if docs and isinstance(docs[0], tuple):
-        # Fallback path: docs are (id, data)
-        for doc_id, data in docs:
-            history.append({
-                "id": doc_id,
-                "file_hash": data.get("file_hash"),
-                "question": data.get("question"),
-                "answer": data.get("answer"),
-                "confidence": data.get("confidence"),
-                "timestamp": data.get("timestamp")
-            })
-    else:
-        for doc in docs:
-            data = doc.to_dict()
-            history.append({
-                "id": doc.id,
-                "file_hash": data.get("file_hash"),
-                "question": data.get("question"),
-                "answer": data.get("answer"),
-                "confidence": data.get("confidence"),
-                "timestamp": data.get("timestamp")
-            })
+    for doc in docs:
+        data = doc.to_dict()
+        history.append({
+            "id": doc.id,
+            "file_hash": data.get("file_hash"),
+            "question": data.get("question"),
+            "answer": data.get("answer"),
+            "confidence": data.get("confidence"),
+            "timestamp": data.get("timestamp")
+        })
 
     return ChatHistoryResponse(history=history, total_count=len(history))
 
 @router.post("/users/confidential-report", response_model=ConfidentialReportResponse, tags=["Users"])
 async def generate_confidential_report(
     req: ConfidentialReportRequest,
+    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_user)
 ):
     """Generate confidential reports that are NOT used for training."""
     user_id = current_user.get("uid")
 
-    doc_ref = firestore_db.collection("documents").document(req.file_hash)
-    doc = doc_ref.get()
-    if not doc.exists or doc.to_dict().get("owner_id") != user_id:
-        raise HTTPException(status_code=404, detail="Document not found or access denied.")
+    if req.report_type not in REPORT_PROMPTS:
+        raise HTTPException(400, "Invalid report type. Use: financial, legal_risks, or compliance")
 
-    from app.services.embedding import query_vectors
-    res = query_vectors("", file_id=req.file_hash, top_k=50)
-    docs = res.get("documents", [[]])
-    if not docs or not docs[0]:
+    # Ownership check and chunk fetch overlap; chunks are only used once ownership passes
+    _, full_text = await asyncio.gather(
+        verify_owner(req.file_hash, user_id),
+        aget_document_text(req.file_hash, max_chunks=50),
+    )
+    if not full_text:
         raise HTTPException(404, "Document not found")
 
-    full_text = "\n\n".join(docs[0])
-
-    if req.report_type == "financial":
-        prompt = f"""Generate a confidential financial analysis report for this legal document. Focus on:
-
-1. All financial obligations and costs
-2. Payment terms and schedules
-3. Penalties and late fees
-4. Tax implications
-5. Financial risks and liabilities
-
-Document: {full_text}
-
-Confidential Financial Report:"""
-    elif req.report_type == "legal_risks":
-        prompt = f"""Generate a confidential legal risk assessment for this document. Identify:
-
-1. Potential legal liabilities
-2. Compliance risks
-3. Contractual obligations
-4. Termination risks
-5. Dispute resolution procedures
-6. Regulatory compliance issues
-
-Document: {full_text}
-
-Confidential Legal Risk Assessment:"""
-    elif req.report_type == "compliance":
-        prompt = f"""Generate a confidential compliance analysis for this document. Assess:
-
-1. Regulatory compliance requirements
-2. Industry-specific regulations
-3. Data protection and privacy
-4. Reporting obligations
-5. Audit requirements
-6. Compliance deadlines
-
-Document: {full_text}
-
-Confidential Compliance Report:"""
-    else:
-        raise HTTPException(400, "Invalid report type. Use: financial, legal_risks, or compliance")
+    prompt = build_report_prompt(req.report_type, full_text)
 
-    answer, confidence = call_hf_inference(prompt)
+    answer, confidence = await acall_hf_inference(prompt)
 
-    firestore_db.collection("confidential_reports").add({
+    # Stored after the response is sent
+    background_tasks.add_task(firestore_db.collection("confidential_reports").add, {
         "user_id": user_id,
         "file_hash": req.file_hash,
         "report_type": req.report_type,
         "report": answer,
         "confidence": confidence,
-        "timestamp": firestore.SERVER_TIMESTAMP,
+        "timestamp": SERVER_TIMESTAMP,
         "is_confidential": True,
         "not_for_training": True
     })
@@ -1,80 +1,123 @@
-from app.database import embedder, vector_collection
+from app.database import embedder
+from app import database
+from app.config import settings
 import logging
-import gc
-from typing import List, Dict, Any
+import asyncio
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+from typing import List, Dict, Any, Optional
 import numpy as np
+from cachetools import TTLCache
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DOCUMENT_TEXT_CACHE_TTL_SECONDS = 86400
+
+# (file_hash, max_chunks) -> joined chunk text, for prompts over a whole document
+_document_text_cache = TTLCache(maxsize=256, ttl=DOCUMENT_TEXT_CACHE_TTL_SECONDS)
+# cachetools caches are not thread-safe; readers run in to_thread workers and
+# ingestion threads prune it
+_document_text_lock = threading.Lock()
+
+INGEST_GROUP_SIZE = 128  # Chunks embedded per group before its insert is queued
+INGEST_MAX_CONCURRENT_ADDS = 8  # Vector DB inserts in flight while the next group embeds
+VECTOR_BATCH_SIZE = 32  # Vectors per Chroma add request
+ADD_RETRIES = 3
+ADD_RETRY_BACKOFF_SECONDS = 0.5  # Doubled after every failed attempt
+
+def _collection_for_write(metadatas: List[Dict]):
+    """Shared collection, or the file's own one when CHROMA_PER_FILE_COLLECTIONS is on."""
+    if not settings.CHROMA_PER_FILE_COLLECTIONS:
+        return database.vector_collection
+    # Callers store one file's chunks at a time
+    file_hash = metadatas[0].get("file_hash")
+    return database.get_file_collection(file_hash, create=True) if file_hash else None
+
+def _add_with_retry(collection, **batch) -> None:
+    """collection.add with exponential backoff; chunk ids are deterministic, so a retried add is safe."""
+    for attempt in range(ADD_RETRIES):
+        try:
+            collection.add(**batch)
+            return
+        except Exception as e:
+            if attempt == ADD_RETRIES - 1:
+                raise
+            delay = ADD_RETRY_BACKOFF_SECONDS * (2 ** attempt)
+            logger.warning(f"Vector add failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def _collection_for_query(file_id):
+    """Return (collection, where) for a query scoped to file_id."""
+    if file_id and settings.CHROMA_PER_FILE_COLLECTIONS:
+        collection = database.get_file_collection(file_id)
+        if collection is not None:
+            # Only this file's vectors are in the HNSW graph, so no filter is needed
+            return collection, None
+    # Shared collection; also covers files indexed before per-file collections
+    return database.vector_collection, ({"file_hash": file_id} if file_id else None)
+
 class OptimizedEmbeddingService:
     def __init__(self, batch_size: int = 32):
         self.batch_size = batch_size
     
-    def embed_texts_batch(self, texts: List[str]) -> List[List[float]]:
+    def embed_texts_batch(self, texts: List[str]) -> np.ndarray:
         """
-        Embed texts in batches to manage memory usage.
+        Embed texts with a single encode call. sentence-transformers sorts the
+        texts by length and batches them itself, so each batch pads only to
+        similar-length neighbours; rows come back in input order. Returns one
+        float32 row per text, kept as an ndarray all the way into the vector store.
+        Raises if encoding fails.
         """
+        if not texts:
+            logger.warning("No texts provided for embedding")
+            return np.empty((0, embedder.get_sentence_embedding_dimension()), dtype=np.float32)
+        
         try:
-            if not texts:
-                logger.warning("No texts provided for embedding")
-                return []
-            
-            all_embeddings = []
-            
-            # Process in batches
-            for i in range(0, len(texts), self.batch_size):
-                batch_texts = texts[i:i + self.batch_size]
-                
-                try:
-                    # Embed batch
-                    batch_embeddings = embedder.encode(
-                        batch_texts, 
-                        show_progress_bar=False, 
-                        convert_to_numpy=True,
-                        batch_size=min(len(batch_texts), self.batch_size)
-                    )
-                    
-                    # Convert to list and add to results
-                    if hasattr(batch_embeddings, 'tolist'):
-                        batch_embeddings_list = batch_embeddings.tolist()
-                    else:
-                        batch_embeddings_list = batch_embeddings
-                    
-                    all_embeddings.extend(batch_embeddings_list)
-                    
-                    # Force garbage collection after each batch
-                    del batch_embeddings
-                    gc.collect()
-                    
-                    logger.info(f"Processed batch {i//self.batch_size + 1}/{(len(texts) + self.batch_size - 1)//self.batch_size}")
-                    
-                except Exception as e:
-                    logger.error(f"Error embedding batch {i//self.batch_size + 1}: {e}")
-                    # Add empty embeddings for failed batch
-                    all_embeddings.extend([[0.0] * 384] * len(batch_texts))  # Assuming 384-dim embeddings
-            
-            return all_embeddings
+            # On CUDA, batches stay on the GPU (fp16 when EMBEDDING_FP16) and cross to
+            # the host once, as fp32, instead of a device sync per batch. Otherwise
+            # encode already returns a float32 ndarray (its default).
+            on_gpu = embedder.device.type == "cuda"
+            embeddings = embedder.encode(
+                texts,
+                show_progress_bar=False,
+                convert_to_tensor=on_gpu,
+                batch_size=self.batch_size
+            )
+            if on_gpu:
+                embeddings = embeddings.float().cpu().numpy()
+            logger.info(f"Embedded {len(texts)} texts")
+            return embeddings
             
         except Exception as e:
-            logger.error(f"Error in batch embedding: {e}")
+            # No zero-vector stand-ins: they would be indexed and match queries arbitrarily
+            logger.error(f"Error embedding {len(texts)} texts: {e}")
             raise
     
     def add_vectors_batch(self, ids: List[str], documents: List[str], 
-                          metadatas: List[Dict], embeddings: List[List[float]]) -> bool:
+                          metadatas: List[Dict], embeddings: np.ndarray,
+                          verify_count: bool = True) -> bool:
         """
-        Add vectors to database in batches to manage memory.
+        Add vectors to database in batches to manage memory. Embeddings are
+        passed to Chroma as ndarray slices (views), never as lists of floats.
         """
         try:
-            if not all([ids, documents, metadatas, embeddings]):
+            if not all([ids, documents, metadatas]) or len(embeddings) == 0:
                 logger.warning("Missing required parameters for add_vectors_batch")
                 return False
             
+            collection = _collection_for_write(metadatas)
+            if collection is None:
+                logger.error("No vector collection available for these chunks")
+                return False
+            
             logger.info(f"Starting to add {len(ids)} vectors to ChromaDB Cloud...")
             
-            # Process in smaller batches for vector database
-            vector_batch_size = min(self.batch_size, 16)  # Smaller batches for vector DB
+            # Requests of VECTOR_BATCH_SIZE; process_and_store_chunks keeps several groups in flight
+            vector_batch_size = VECTOR_BATCH_SIZE
             
             for i in range(0, len(ids), vector_batch_size):
                 batch_ids = ids[i:i + vector_batch_size]
@@ -93,7 +136,8 @@ class OptimizedEmbeddingService:
                         logger.info(f"First metadata: {batch_metas[0]}")
                         logger.info(f"First embedding length: {len(batch_embs[0])}")
                     
-                    vector_collection.add(
+                    _add_with_retry(
+                        collection,
                         ids=batch_ids,
                         documents=batch_docs,
                         metadatas=batch_metas,
@@ -106,19 +150,16 @@ class OptimizedEmbeddingService:
                     logger.error(f"❌ Error adding batch {i//vector_batch_size + 1}: {e}")
                     logger.error(f"Error type: {type(e).__name__}")
                     return False
-                
-                # Clean up batch variables
-                del batch_ids, batch_docs, batch_metas, batch_embs
-                gc.collect()
             
             logger.info(f"✅ Successfully added {len(ids)} vectors to ChromaDB Cloud")
             
             # Verify storage by counting
-            try:
-                total_count = vector_collection.count()
-                logger.info(f"✅ Total vectors in collection after addition: {total_count}")
-            except Exception as e:
-                logger.warning(f"Could not verify vector count: {e}")
+            if verify_count:
+                try:
+                    total_count = collection.count()
+                    logger.info(f"✅ Total vectors in collection after addition: {total_count}")
+                except Exception as e:
+                    logger.warning(f"Could not verify vector count: {e}")
             
             return True
             
@@ -130,33 +171,49 @@ class OptimizedEmbeddingService:
     def process_and_store_chunks(self, chunks: List[Dict[str, Any]]) -> bool:
         """
         Process chunks and store them efficiently in the vector database.
+        Chunks are embedded group by group; each group's insert runs on a small
+        thread pool so it overlaps with embedding the next group.
         """
         try:
             if not chunks:
                 logger.warning("No chunks to process")
                 return False
             
-            # Extract data for processing
-            texts = [chunk["text"] for chunk in chunks]
-            chunk_ids = [chunk["chunk_id"] for chunk in chunks]
-            metadatas = [chunk["metadata"] for chunk in chunks]
-            
-            # Generate embeddings in batches
-            logger.info(f"Generating embeddings for {len(texts)} chunks...")
-            embeddings = self.embed_texts_batch(texts)
-            
-            if not embeddings or len(embeddings) != len(texts):
-                logger.error("Embedding generation failed or mismatch")
-                return False
-            
-            # Store vectors in batches
-            logger.info(f"Storing {len(embeddings)} vectors in database...")
-            success = self.add_vectors_batch(chunk_ids, texts, metadatas, embeddings)
-            
-            # Clean up
-            del texts, chunk_ids, metadatas, embeddings
-            gc.collect()
+            logger.info(f"Generating and storing embeddings for {len(chunks)} chunks...")
+            pending = set()
+            success = True
+            with ThreadPoolExecutor(max_workers=INGEST_MAX_CONCURRENT_ADDS) as pool:
+                for start in range(0, len(chunks), INGEST_GROUP_SIZE):
+                    # Backpressure: at most one queued group per insert thread, so a large
+                    # PDF never holds all of its embeddings in memory at once
+                    if len(pending) >= 2 * INGEST_MAX_CONCURRENT_ADDS:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        if not all(f.result() for f in done):
+                            # An insert failed after its retries; stop embedding the rest
+                            success = False
+                            break
+                    
+                    group = chunks[start:start + INGEST_GROUP_SIZE]
+                    texts = [chunk["text"] for chunk in group]
+                    chunk_ids = [chunk["chunk_id"] for chunk in group]
+                    metadatas = [chunk["metadata"] for chunk in group]
+                    
+                    embeddings = self.embed_texts_batch(texts)
+                    if len(embeddings) != len(texts):
+                        logger.error("Embedding generation failed or mismatch")
+                        success = False
+                        break
+                    
+                    pending.add(pool.submit(
+                        self.add_vectors_batch, chunk_ids, texts, metadatas, embeddings, False
+                    ))
             
+            # Leaving the pool waited for every insert
+            success = success and all(f.result() for f in pending)
+            if success:
+                logger.info(f"✅ Stored {len(chunks)} chunks")
+            # Drop text cached by a request that read the file while it was still being indexed
+            forget_document_text(chunks[0]["metadata"].get("file_hash"))
             return success
             
         except Exception as e:
@@ -164,7 +221,7 @@ class OptimizedEmbeddingService:
             return False
 
 # Create global instance
-embedding_service = OptimizedEmbeddingService()
+embedding_service = OptimizedEmbeddingService(batch_size=settings.EMBEDDING_BATCH_SIZE)
 
 # Backward compatibility functions
 def embed_texts(texts):
@@ -173,29 +230,127 @@ def embed_texts(texts):
 
 def add_vectors(ids, documents, metadatas, embeddings):
     """Legacy function for backward compatibility"""
-    return embedding_service.add_vectors_batch(ids, documents, metadatas, embeddings)
+    return embedding_service.add_vectors_batch(ids, documents, metadatas, np.asarray(embeddings, dtype=np.float32))
+
+@lru_cache(maxsize=1024)
+def embed_query(text: str) -> np.ndarray:
+    """
+    Unit-norm float32 embedding of a question with the same model that embedded
+    the chunks. Cached per string, so QA retrieval and the semantic answer
+    cache share one encoder pass; the returned array is read-only.
+    """
+    vec = embedder.encode(text, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)
+    vec = vec.astype(np.float32, copy=False)
+    vec.flags.writeable = False
+    return vec
+
+def _query_args(query_texts: List[str], query_embeddings=None) -> Dict[str, Any]:
+    """Query by our own embeddings; Chroma's embedding function is only a fallback without an embedder."""
+    if query_embeddings is not None:
+        return {"query_embeddings": query_embeddings}
+    if embedder is None:
+        return {"query_texts": query_texts}
+    if len(query_texts) == 1:
+        return {"query_embeddings": [embed_query(query_texts[0])]}
+    embeddings = embedder.encode(query_texts, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)
+    return {"query_embeddings": embeddings.astype(np.float32, copy=False)}
 
-def query_vectors(query_text, file_id=None, top_k=5):
+def query_vectors(query_text, file_id=None, top_k=5, query_embedding: Optional[np.ndarray] = None):
     try:
-        filter = {"file_hash": file_id} if file_id else {}
+        collection, filter = _collection_for_query(file_id)
         
         if not query_text:
-            logger.info(f"Getting all documents for file_hash: {file_id}")
-            # When no query text, get all documents for the file
-            # Use a generic query to get all documents
-            results = vector_collection.query(
-                query_texts=["document"],  # Generic query to get all
-                n_results=top_k, 
-                where=filter
-            )
-        else:
-            results = vector_collection.query(
-                query_texts=[query_text], 
-                n_results=top_k, 
-                where=filter
-            )
+            logger.info(f"Getting documents for file_hash: {file_id}")
+            # No query text: read the file's chunks by metadata; there is nothing to rank by
+            res = collection.get(where=filter, limit=top_k, include=["documents", "metadatas"])
+            return {
+                "ids": [res.get("ids") or []],
+                "documents": [res.get("documents") or []],
+                "metadatas": [res.get("metadatas") or []],
+            }
+        
+        results = collection.query(
+            n_results=top_k, 
+            where=filter,
+            **_query_args([query_text], None if query_embedding is None else [query_embedding])
+        )
         
         return results
     except Exception as e:
         logger.error(f"Error querying vectors: {e}")
         return {"documents": [], "metadatas": [], "distances": []}
+
+def query_vectors_batch(query_texts: List[str], file_id=None, top_k=5) -> List[Dict[str, Any]]:
+    """
+    Several questions against the same file in one Chroma round trip.
+    Returns one single-query result (same shape as query_vectors) per question.
+    """
+    try:
+        collection, filter = _collection_for_query(file_id)
+        res = collection.query(n_results=top_k, where=filter, **_query_args(list(query_texts)))
+        fields = [k for k in ("ids", "documents", "metadatas", "distances") if res.get(k)]
+        return [{k: [res[k][i]] for k in fields} for i in range(len(query_texts))]
+    except Exception as e:
+        logger.error(f"Error querying vectors: {e}")
+        return [{"documents": [], "metadatas": [], "distances": []} for _ in query_texts]
+
+def get_all_chunks(file_id: str) -> List[Dict[str, Any]]:
+    """
+    Every stored chunk of a file in document order, fetched by metadata filter
+    (a keyed lookup, no similarity search).
+    """
+    collection, filter = _collection_for_query(file_id)
+    res = collection.get(where=filter, include=["documents", "metadatas"])
+    chunks = [
+        {"text": text, "meta": meta or {}}
+        for text, meta in zip(res.get("documents") or [], res.get("metadatas") or [])
+    ]
+    chunks.sort(key=lambda c: (c["meta"].get("page", 0), c["meta"].get("chunk_index", 0)))
+    return chunks
+
+def get_document_text(file_id: str, max_chunks: Optional[int] = None) -> str:
+    """
+    Joined text of a file's first max_chunks chunks. Cached per file once its
+    ingestion has completed, since stored chunks never change after that.
+    """
+    key = (file_id, max_chunks)
+    with _document_text_lock:
+        text = _document_text_cache.get(key)
+    if text is None:
+        # Checked before reading: text read mid-ingestion is partial, and other
+        # workers would never see forget_document_text drop it
+        completed = database.document_is_completed(file_id)
+        try:
+            chunks = get_all_chunks(file_id)
+        except Exception as e:
+            logger.error(f"Error fetching chunks for {file_id}: {e}")
+            return ""
+        text = "\n\n".join(c["text"] for c in chunks[:max_chunks])
+        if text and completed:
+            with _document_text_lock:
+                _document_text_cache[key] = text
+    return text
+
+async def aget_document_text(file_id: str, max_chunks: Optional[int] = None) -> str:
+    return await asyncio.to_thread(get_document_text, file_id, max_chunks)
+
+def forget_document_text(file_hash: str) -> None:
+    with _document_text_lock:
+        for key in [k for k in list(_document_text_cache.keys()) if k[0] == file_hash]:
+            _document_text_cache.pop(key, None)
+
+def delete_file_vectors(file_hash: str) -> None:
+    """Remove every stored chunk of a file."""
+    forget_document_text(file_hash)
+    if settings.CHROMA_PER_FILE_COLLECTIONS:
+        # Dropping the collection is a single call, no matter how many chunks it holds
+        database.delete_file_collection(file_hash)
+    # Files indexed into the shared collection (always, when the flag is off)
+    database.vector_collection.delete(where={"file_hash": file_hash})
+
+async def aquery_vectors(query_text, file_id=None, top_k=5):
+    """Async variant of query_vectors for route handlers; the Chroma HTTP call runs in a worker thread."""
+    return await asyncio.to_thread(query_vectors, query_text, file_id=file_id, top_k=top_k)
+
+async def aquery_vectors_batch(query_texts: List[str], file_id=None, top_k=5) -> List[Dict[str, Any]]:
+    return await asyncio.to_thread(query_vectors_batch, query_texts, file_id=file_id, top_k=top_k)
@@ -1,46 +1,127 @@
 # app/services/inference.py
+import asyncio
 import requests
 import logging
+import httpx
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from app.config import settings  # OPENROUTER_API_KEY must be set in settings
+from app.utils.http_client import get_http_client
 
 logger = logging.getLogger(__name__)
 
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_MODEL = "anthropic/claude-3-haiku"
+ERROR_ANSWER = "An error occurred while processing your request."
+
+RETRY_STATUSES = frozenset({429, 502, 503, 504})  # Rate limiting and gateway errors
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 0.5  # Doubled after every failed attempt
+
+# Pooled keep-alive connections for the sync path. A completion has no side
+# effects, so POSTs are retried on rate limiting and gateway errors.
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=16,
+    max_retries=Retry(
+        total=MAX_ATTEMPTS - 1,  # Counts retries, not attempts
+        backoff_factor=RETRY_BACKOFF_SECONDS,
+        status_forcelist=sorted(RETRY_STATUSES),
+        allowed_methods=frozenset({"POST"}),
+        raise_on_status=False,
+    ),
+))
+
+
+def _openrouter_request(prompt: str):
+    api_key = settings.OPENROUTER_API_KEY
+    if not api_key:
+        raise RuntimeError("Missing OPENROUTER_API_KEY in configuration")
+
+    headers = {"Authorization": f"Bearer {api_key}"}
+    body = {
+        "model": OPENROUTER_MODEL,
+        "messages": [
+            {"role": "user", "content": prompt}
+        ]
+    }
+    return headers, body
+
+
+def _parse_completion(data: dict):
+    answer = data["choices"][0]["message"]["content"]
+    confidence = 0.95
+
+    lowered = answer.lower()
+    if ("not stated" in lowered) or ("does not contain" in lowered):
+        confidence = 0.5
+
+    return answer, confidence
+
 
 def call_openrouter_inference(prompt: str):
     try:
-        api_key = settings.OPENROUTER_API_KEY
-        if not api_key:
-            raise RuntimeError("Missing OPENROUTER_API_KEY in configuration")
-
-        logger.info("Calling OpenRouter with model anthropic/claude-3-haiku")
-
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-            },
-            json={
-                "model": "anthropic/claude-3-haiku",
-                "messages": [
-                    {"role": "user", "content": prompt}
-                ]
-            }
-        )
+        headers, body = _openrouter_request(prompt)
+
+        logger.info(f"Calling OpenRouter with model {OPENROUTER_MODEL}")
+
+        response = _session.post(url=OPENROUTER_URL, headers=headers, json=body, timeout=(10, 60))
         response.raise_for_status()
 
-        data = response.json()
-        answer = data["choices"][0]["message"]["content"]
-        confidence = 0.95
+        return _parse_completion(orjson.loads(response.content))
 
-        lowered = answer.lower()
-        if ("not stated" in lowered) or ("does not contain" in lowered):
-            confidence = 0.5
+    except Exception as e:
+        logger.error(f"OpenRouter API request failed: {e}")
+        return ERROR_ANSWER, 0.0
 
-        return answer, confidence
+
+async def _post_with_retry(headers: dict, body: dict) -> httpx.Response:
+    """POST a completion, retrying transport errors and RETRY_STATUSES with exponential backoff."""
+    client = get_http_client()
+    for attempt in range(MAX_ATTEMPTS):
+        last = attempt == MAX_ATTEMPTS - 1
+        try:
+            response = await client.post(OPENROUTER_URL, headers=headers, json=body)
+        except httpx.TransportError as e:
+            if last:
+                raise
+            logger.warning(f"OpenRouter request failed ({e}); retrying")
+        else:
+            if response.status_code not in RETRY_STATUSES or last:
+                return response
+            logger.warning(f"OpenRouter returned {response.status_code}; retrying")
+        await asyncio.sleep(RETRY_BACKOFF_SECONDS * (2 ** attempt))
+
+
+async def acall_openrouter_inference(prompt: str):
+    """Same as call_openrouter_inference, on the shared pooled async client."""
+    try:
+        headers, body = _openrouter_request(prompt)
+
+        logger.info(f"Calling OpenRouter with model {OPENROUTER_MODEL}")
+
+        response = await _post_with_retry(headers, body)
+        response.raise_for_status()
+
+        return _parse_completion(orjson.loads(response.content))
 
     except Exception as e:
         logger.error(f"OpenRouter API request failed: {e}")
-        return "An error occurred while processing your request.", 0.0
+        return ERROR_ANSWER, 0.0
+
+
+async def warm_up_inference_client():
+    """
+    Open the pooled connection to OpenRouter (DNS, TLS, HTTP/2) before the first
+    request needs it. A HEAD costs nothing; the status code is irrelevant.
+    """
+    try:
+        await get_http_client().head(OPENROUTER_URL, timeout=5)
+        logger.info("Inference HTTP connection warmed up")
+    except Exception as e:
+        logger.warning(f"Inference client warmup failed: {e}")
 
 
 # Backward-compatible alias for previous import name
@@ -48,17 +129,6 @@ def call_hf_inference(prompt: str):
     return call_openrouter_inference(prompt)
 
 
-def build_rag_prompt(question: str, snippets: list) -> str:
-    context = "\n\n".join(snippets)
-    prompt = (
-        "Based ONLY on the following context from a legal document, please perform the following tasks:\n\n"
-        f"CONTEXT:\n---\n{context}\n---\n\n"
-        f"USER'S QUESTION: \"{question}\"\n\n"
-        "TASKS:\n"
-        "1.  Direct Answer: Answer the user's question directly. If the answer isn't in the context, state 'The document does not provide an answer to this question.'\n"
-        "2.  Summary: Provide a brief, simple-language summary of the provided context.\n"
-        "3.  Key Clauses & Obligations: Identify and list the most important clauses, obligations, or deadlines mentioned.\n"
-        "4.  Red Flags & Risks: Point out any potential red flags, risks, penalties, or unusual terms for the user.\n\n"
-        "Please format your response clearly using markdown."
-    )
-    return prompt
\ No newline at end of file
+async def acall_hf_inference(prompt: str):
+    return await acall_openrouter_inference(prompt)
+
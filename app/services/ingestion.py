@@ -0,0 +1,78 @@
+# app/services/ingestion.py
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+from app.config import settings
+from app.database import firestore_db, SERVER_TIMESTAMP
+from app.services.pdf_parser import pdf_parser
+from app.services.embedding import embedding_service
+from app.services.summary import delete_summary, precompute_summary
+
+# PDF parsing and embedding run here instead of on the event loop (where
+# BackgroundTasks runs async functions), so uploads never stall request handling
+_executor = ThreadPoolExecutor(max_workers=settings.INGESTION_WORKERS, thread_name_prefix="ingest")
+
+
+def _set_status(collection: str, file_hash: str, fields: dict) -> None:
+    if not firestore_db:
+        return
+    try:
+        firestore_db.collection(collection).document(file_hash).update(fields)
+    except Exception as e:
+        print(f"Error updating {collection} status for {file_hash}: {e}")
+
+
+def process_pdf_job(collection: str, file_hash: str, file_path: str, original_filename: str,
+                    loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+    """
+    Parse a saved upload, store its chunks and record the outcome on the
+    Firestore document in `collection`. When loop is given, the document
+    summary is precomputed on it afterwards.
+    """
+    try:
+        print(f"Starting background processing for file: {original_filename}")
+
+        # Parse straight from the saved upload; chunks are keyed by file_hash
+        result = pdf_parser.process_pdf_file(file_path, file_hash=file_hash, batch_size=settings.PDF_PROCESSING_BATCH_SIZE)
+
+        if "error" in result:
+            print(f"Error processing PDF: {result['error']}")
+            _set_status(collection, file_hash, {"processing_status": "failed", "error": result["error"]})
+            return
+
+        # Store chunks in vector database
+        if result["chunks"]:
+            success = embedding_service.process_and_store_chunks(result["chunks"])
+            if success:
+                print(f"Successfully processed {len(result['chunks'])} chunks for {original_filename}")
+            else:
+                print(f"Failed to store chunks for {original_filename}")
+                _set_status(collection, file_hash, {"processing_status": "failed", "error": "Failed to store chunks"})
+                return
+
+        _set_status(collection, file_hash, {
+            "processing_status": "completed",
+            "total_chunks": result.get("total_chunks", 0),
+            "processing_completed": SERVER_TIMESTAMP
+        })
+
+        # A summary stored before this run does not cover these chunks
+        delete_summary(file_hash)
+
+        # Precompute the summary so the first summarize request is a cache hit
+        if result["chunks"] and loop is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(precompute_summary(file_hash), loop).result()
+            except Exception as e:
+                print(f"Error precomputing summary for {original_filename}: {e}")
+
+    except Exception as e:
+        print(f"Background processing error for {original_filename}: {e}")
+        _set_status(collection, file_hash, {"processing_status": "failed", "error": str(e)})
+
+
+def submit_pdf_job(collection: str, file_hash: str, file_path: str, original_filename: str,
+                   precompute_summary: bool = False) -> Future:
+    """Queue a saved upload for ingestion and return immediately. Call from the event loop."""
+    loop = asyncio.get_running_loop() if precompute_summary else None
+    return _executor.submit(process_pdf_job, collection, file_hash, file_path, original_filename, loop)
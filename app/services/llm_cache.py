@@ -0,0 +1,100 @@
+# app/services/llm_cache.py
+import asyncio
+import hashlib
+import logging
+from typing import Hashable, List, Optional, Tuple
+import numpy as np
+from cachetools import TTLCache
+from app.config import settings
+from app.database import embedder
+from app.services.embedding import embed_query
+from app.services.inference import acall_hf_inference
+from app.utils.coalescer import RequestCoalescer
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_ENTRIES_PER_SCOPE = 32  # Most recent questions kept per scope
+SEMANTIC_MAX_SCOPES = 256  # Each scope preallocates its ring (32 x 384 float32 = 48 KiB)
+
+# sha256(prompt) -> (answer, confidence)
+_exact_cache = TTLCache(maxsize=settings.LLM_CACHE_MAX_ENTRIES, ttl=settings.LLM_CACHE_TTL_SECONDS)
+# scope -> _SemanticRing of recent questions and their answers
+_semantic_cache = TTLCache(maxsize=SEMANTIC_MAX_SCOPES, ttl=settings.LLM_CACHE_TTL_SECONDS)
+# Identical prompts that miss both caches while one is already in flight share its call
+_inflight = RequestCoalescer(ttl=0)
+
+
+def _prompt_key(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+
+class _SemanticRing:
+    """Recent question embeddings of one scope as a contiguous float32 ring buffer."""
+
+    def __init__(self, dim: int, capacity: int = SEMANTIC_ENTRIES_PER_SCOPE):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.results: List[Optional[Tuple[str, float]]] = [None] * capacity
+        self.size = 0
+        self.next = 0
+
+    def add(self, vec: np.ndarray, result: Tuple[str, float]) -> None:
+        self.vectors[self.next] = vec
+        self.results[self.next] = result
+        self.next = (self.next + 1) % len(self.results)
+        self.size = min(self.size + 1, len(self.results))
+
+    def lookup(self, query: np.ndarray) -> Optional[Tuple[str, float]]:
+        if self.size == 0:
+            return None
+        # Rows are unit-norm, so one matrix-vector product gives every cosine similarity
+        sims = self.vectors[:self.size] @ query
+        best = int(sims.argmax())
+        if sims[best] >= settings.LLM_SEMANTIC_CACHE_THRESHOLD:
+            return self.results[best]
+        return None
+
+
+async def cached_inference(prompt: str, semantic_scope: Optional[Hashable] = None,
+                           semantic_text: Optional[str] = None) -> Tuple[str, float]:
+    """
+    acall_hf_inference behind an exact-prompt TTL cache. When LLM_SEMANTIC_CACHE
+    is on and semantic_scope and semantic_text are given (QA: (file hash, top_k)
+    and the question), a miss also checks earlier questions in that scope by
+    embedding similarity. Concurrent misses on the same prompt share a single
+    upstream call.
+    Do not route confidential prompts through here.
+    """
+    key = _prompt_key(prompt)
+    cached = _exact_cache.get(key)
+    if cached is not None:
+        return cached
+
+    use_semantic = (
+        settings.LLM_SEMANTIC_CACHE and embedder is not None
+        and semantic_scope is not None and semantic_text
+    )
+    query_vec = None
+    if use_semantic:
+        try:
+            # Usually cached already: QA retrieval embedded the same question
+            query_vec = await asyncio.to_thread(embed_query, semantic_text)
+            ring = _semantic_cache.get(semantic_scope)
+            if ring is not None:
+                hit = ring.lookup(query_vec)
+                if hit is not None:
+                    return hit
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup failed: {e}")
+            query_vec = None
+
+    result = await _inflight.run(key, lambda: acall_hf_inference(prompt))
+
+    # Failed LLM calls come back with zero confidence and are not kept
+    if result[1] > 0:
+        _exact_cache[key] = result
+        if query_vec is not None:
+            ring = _semantic_cache.get(semantic_scope)
+            if ring is None:
+                ring = _semantic_cache[semantic_scope] = _SemanticRing(dim=query_vec.shape[0])
+            ring.add(query_vec, result)
+    return result
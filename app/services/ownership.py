@@ -0,0 +1,79 @@
+# app/services/ownership.py
+import asyncio
+from typing import Iterable, Optional
+from cachetools import TTLCache
+from fastapi import HTTPException
+from app.database import firestore_db
+
+OWNER_CACHE_TTL_SECONDS = 300
+ACCESS_DENIED = "Document not found or access denied."
+
+_MISSING = object()
+
+# file_hash -> owner_id (None for legacy documents without one). Only documents
+# that exist are cached, so a fresh upload is never hidden by a stale miss.
+_owner_cache = TTLCache(maxsize=10_000, ttl=OWNER_CACHE_TTL_SECONDS)
+
+
+def remember_owner(file_hash: str, owner_id: Optional[str]) -> None:
+    _owner_cache[file_hash] = owner_id
+
+
+def forget_owner(file_hash: str) -> None:
+    _owner_cache.pop(file_hash, None)
+
+
+def _check(owner_id, uid: str, allow_unowned: bool, detail: str) -> None:
+    if owner_id is _MISSING:
+        raise HTTPException(status_code=404, detail=detail)
+    if owner_id is None and allow_unowned:
+        return
+    if owner_id != uid:
+        raise HTTPException(status_code=404, detail=detail)
+
+
+async def verify_owner(file_hash: str, uid: str, allow_unowned: bool = False,
+                       detail: str = ACCESS_DENIED) -> None:
+    """
+    Raise 404 unless uid owns the document. allow_unowned lets legacy
+    documents without an owner_id through.
+    """
+    owner_id = _owner_cache.get(file_hash, _MISSING)
+    if owner_id is _MISSING:
+        doc = await asyncio.to_thread(firestore_db.collection("documents").document(file_hash).get)
+        if doc.exists:
+            owner_id = doc.to_dict().get("owner_id")
+            remember_owner(file_hash, owner_id)
+    _check(owner_id, uid, allow_unowned, detail)
+
+
+async def get_owned_document(file_hash: str, uid: str, detail: str = ACCESS_DENIED) -> dict:
+    """
+    verify_owner for callers that also need the document itself: always reads
+    it (no cache) and returns its fields. Raises 404 unless uid owns it.
+    """
+    doc = await asyncio.to_thread(firestore_db.collection("documents").document(file_hash).get)
+    owner_id = _MISSING
+    data = {}
+    if doc.exists:
+        data = doc.to_dict()
+        owner_id = data.get("owner_id")
+        remember_owner(file_hash, owner_id)
+    _check(owner_id, uid, False, detail)
+    return data
+
+
+async def verify_owners(file_hashes: Iterable[str], uid: str) -> None:
+    """verify_owner for several documents, fetching all cache misses in one batched read."""
+    owners = {h: _owner_cache.get(h, _MISSING) for h in file_hashes}
+    misses = [h for h, owner_id in owners.items() if owner_id is _MISSING]
+    if misses:
+        refs = [firestore_db.collection("documents").document(h) for h in misses]
+        snapshots = await asyncio.to_thread(lambda: list(firestore_db.get_all(refs)))
+        # get_all does not preserve request order
+        for snap in snapshots:
+            if snap.exists:
+                owners[snap.id] = snap.to_dict().get("owner_id")
+                remember_owner(snap.id, owners[snap.id])
+    for file_hash, owner_id in owners.items():
+        _check(owner_id, uid, False, f"Document {file_hash} not found or access denied.")
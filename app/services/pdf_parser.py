@@ -1,11 +1,36 @@
 import fitz
-import hashlib
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Dict, Optional
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyMuPDFLoader
-import tempfile
 import os
-import gc
+from app.config import settings
+from app.utils.fileops import new_file_hasher, file_hash_hexdigest
+
+PARALLEL_CHUNKING_MIN_PAGES = 10  # Smaller PDFs are split in-process; the pool round trip isn't worth it
+
+_chunk_pool: Optional[ProcessPoolExecutor] = None
+_chunk_pool_lock = threading.Lock()
+
+
+def _get_chunk_pool() -> Optional[ProcessPoolExecutor]:
+    """Process pool for page splitting, created on first use; None when PDF_CHUNK_WORKERS is 1."""
+    global _chunk_pool
+    workers = settings.PDF_CHUNK_WORKERS or os.cpu_count() or 1
+    if workers <= 1:
+        return None
+    with _chunk_pool_lock:
+        if _chunk_pool is None:
+            # spawn: the server process holds threads and model state that must not be forked
+            _chunk_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _chunk_pool
+
+
+def _clean_chunks(chunks: List[str]) -> List[str]:
+    # Filter out very short chunks; the splitter already strips whitespace
+    return [chunk for chunk in chunks if len(chunk) > 20]
+
 
 class OptimizedPDFParser:
     def __init__(self, chunk_size: int = 800, chunk_overlap: int = 100):
@@ -19,88 +44,105 @@ class OptimizedPDFParser:
         )
     
     def calculate_file_hash(self, content: bytes) -> str:
-        """Calculate SHA-256 hash of file content for duplicate detection"""
-        return hashlib.sha256(content).hexdigest()
+        """Hash file content for duplicate detection (see FILE_HASH_ALGORITHM)"""
+        hasher = new_file_hasher()
+        # memoryview: hash the buffer in place, no copy of bytearray bodies
+        hasher.update(memoryview(content))
+        return file_hash_hexdigest(hasher)
+    
+    def get_page_count(self, file_path: str) -> int:
+        """Read the page count from the PDF trailer without extracting any text."""
+        with fitz.open(file_path) as doc:
+            return doc.page_count
     
     def extract_text_from_pdf_bytes(self, pdf_bytes: bytes, max_pages: int = None) -> Dict:
         """
         Extract text from PDF bytes with optimized memory management.
         Returns dict with text, hash, and metadata.
         """
+        file_hash = self.calculate_file_hash(pdf_bytes)
         try:
-            # Create temporary file to avoid memory issues
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-                temp_file.write(pdf_bytes)
-                temp_file_path = temp_file.name
-            
-            try:
-                # Use PyMuPDFLoader for better memory management
-                loader = PyMuPDFLoader(temp_file_path)
-                pages = loader.load()
-                
-                # Process all pages if no limit specified, otherwise use the limit
-                if max_pages is not None:
-                    pages = pages[:max_pages]
-                    print(f"Processing limited to {len(pages)} pages")
-                else:
-                    print(f"Processing all {len(pages)} pages")
-                
-                # Extract text and metadata
-                extracted_data = {
-                    "hash": self.calculate_file_hash(pdf_bytes),
-                    "pages": [],
-                    "total_pages": len(pages),
-                    "file_size": len(pdf_bytes)
-                }
-                
-                for i, page in enumerate(pages):
-                    page_data = {
-                        "page": i + 1,
-                        "text": page.page_content,  # Remove the 50000 character limit
-                        "metadata": page.metadata
-                    }
-                    extracted_data["pages"].append(page_data)
-                    
-                    # Force garbage collection every few pages
-                    if i % 10 == 0:
-                        gc.collect()
-                
-                return extracted_data
-                
-            finally:
-                # Clean up temporary file
-                if os.path.exists(temp_file_path):
-                    os.unlink(temp_file_path)
+            # PyMuPDF reads the buffer in place; no temporary file round trip
+            with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+                return self._extract_pages(doc, file_hash, len(pdf_bytes), max_pages)
                     
         except Exception as e:
             print(f"Error processing PDF: {e}")
             return {
-                "hash": self.calculate_file_hash(pdf_bytes),
+                "hash": file_hash,
+                "error": str(e),
+                "chunks": [],
+                "total_chunks": 0
+            }
+    
+    def extract_text_from_pdf_path(self, file_path: str, max_pages: int = None, file_hash: Optional[str] = None) -> Dict:
+        """
+        Extract text from a PDF already on disk, without copying it into memory first.
+        `file_hash` is used as the document key; it is computed from the file when omitted.
+        """
+        try:
+            if file_hash is None:
+                with open(file_path, "rb") as f:
+                    file_hash = self.calculate_file_hash(f.read())
+            
+            with fitz.open(file_path) as doc:
+                return self._extract_pages(doc, file_hash, os.path.getsize(file_path), max_pages)
+            
+        except Exception as e:
+            print(f"Error processing PDF: {e}")
+            return {
+                "hash": file_hash,
                 "error": str(e),
                 "chunks": [],
                 "total_chunks": 0
             }
     
+    def _extract_pages(self, doc, file_hash: str, file_size: int, max_pages: Optional[int]) -> Dict:
+        """Plain text of each page of an open PyMuPDF document."""
+        # Process all pages if no limit specified, otherwise use the limit
+        page_count = doc.page_count if max_pages is None else min(max_pages, doc.page_count)
+        if max_pages is not None:
+            print(f"Processing limited to {page_count} pages")
+        else:
+            print(f"Processing all {page_count} pages")
+        
+        # Extract text and metadata
+        extracted_data = {
+            "hash": file_hash,
+            "pages": [],
+            "total_pages": page_count,
+            "file_size": file_size
+        }
+        
+        for i in range(page_count):
+            extracted_data["pages"].append({
+                "page": i + 1,
+                # Use "blocks" instead if chunking ever needs layout
+                "text": doc[i].get_text("text"),
+                "metadata": {"page": i, "total_pages": doc.page_count}
+            })
+        
+        return extracted_data
+    
     def chunk_text_optimized(self, text: str) -> List[str]:
         """
         Use LangChain's optimized text splitting for better memory management.
         """
         try:
-            if not text or len(text.strip()) < 50:
+            if not self._has_text(text):
                 return []
             
             # Use LangChain's text splitter
-            chunks = self.text_splitter.split_text(text)
-            
-            # Filter out very short chunks
-            filtered_chunks = [chunk.strip() for chunk in chunks if len(chunk.strip()) > 20]
-            
-            return filtered_chunks
+            return _clean_chunks(self.text_splitter.split_text(text))
             
         except Exception as e:
             print(f"Error chunking text: {e}")
             return []
     
+    @staticmethod
+    def _has_text(text: str) -> bool:
+        return bool(text) and len(text.strip()) >= 50
+    
     def process_pdf_in_batches(self, pdf_bytes: bytes, batch_size: int = 3) -> Dict:
         """
         Process PDF in small batches to minimize memory usage.
@@ -108,45 +150,7 @@ class OptimizedPDFParser:
         try:
             # Process ALL pages without limit
             extracted_data = self.extract_text_from_pdf_bytes(pdf_bytes, max_pages=None)
-            
-            if "error" in extracted_data:
-                return extracted_data
-            
-            all_chunks = []
-            total_chunks = 0
-            
-            # Process pages in batches
-            for i in range(0, len(extracted_data["pages"]), batch_size):
-                batch_pages = extracted_data["pages"][i:i + batch_size]
-                
-                for page_data in batch_pages:
-                    page_text = page_data["text"]
-                    page_num = page_data["page"]
-                    
-                    # Chunk the page text
-                    chunks = self.chunk_text_optimized(page_text)
-                    
-                    for idx, chunk in enumerate(chunks):
-                        chunk_data = {
-                            "text": chunk,
-                            "page": page_num,
-                            "chunk_id": f"{extracted_data['hash']}::p{page_num}::c{idx}",
-                            "metadata": {
-                                "file_hash": extracted_data["hash"],
-                                "page": page_num,
-                                "chunk_index": idx
-                            }
-                        }
-                        all_chunks.append(chunk_data)
-                        total_chunks += 1
-                
-                # Force garbage collection after each batch
-                gc.collect()
-            
-            extracted_data["chunks"] = all_chunks
-            extracted_data["total_chunks"] = total_chunks
-            
-            return extracted_data
+            return self._chunk_extracted_pages(extracted_data, batch_size)
             
         except Exception as e:
             print(f"Error in batch processing: {e}")
@@ -156,6 +160,69 @@ class OptimizedPDFParser:
                 "chunks": [],
                 "total_chunks": 0
             }
+    
+    def process_pdf_file(self, file_path: str, file_hash: str, batch_size: int = 3) -> Dict:
+        """
+        Process a PDF stored on disk; chunks are keyed by the given file_hash.
+        """
+        try:
+            extracted_data = self.extract_text_from_pdf_path(file_path, max_pages=None, file_hash=file_hash)
+            return self._chunk_extracted_pages(extracted_data, batch_size)
+            
+        except Exception as e:
+            print(f"Error in batch processing: {e}")
+            return {
+                "hash": file_hash,
+                "error": str(e),
+                "chunks": [],
+                "total_chunks": 0
+            }
+    
+    def _split_pages(self, texts: List[str], batch_size: int) -> List[List[str]]:
+        """Chunks of every page, in page order; large PDFs are split across the process pool."""
+        pool = _get_chunk_pool() if len(texts) >= PARALLEL_CHUNKING_MIN_PAGES else None
+        if pool is not None:
+            try:
+                # The bound split_text pickles just the splitter's settings, so workers
+                # import langchain only, never this app
+                split = iter(pool.map(
+                    self.text_splitter.split_text,
+                    [text for text in texts if self._has_text(text)],
+                    chunksize=max(1, batch_size)
+                ))
+                return [_clean_chunks(next(split)) if self._has_text(text) else [] for text in texts]
+            except Exception as e:
+                print(f"Parallel chunking failed, splitting in-process: {e}")
+        return [self.chunk_text_optimized(text) for text in texts]
+    
+    def _chunk_extracted_pages(self, extracted_data: Dict, batch_size: int) -> Dict:
+        """Split extracted pages into chunks with file/page metadata."""
+        if "error" in extracted_data:
+            return extracted_data
+        
+        all_chunks = []
+        file_hash = extracted_data["hash"]
+        pages = extracted_data["pages"]
+        page_chunks = self._split_pages([page_data["text"] for page_data in pages], batch_size)
+        
+        for page_data, chunks in zip(pages, page_chunks):
+            page_num = page_data["page"]
+            for idx, chunk in enumerate(chunks):
+                all_chunks.append({
+                    "text": chunk,
+                    "page": page_num,
+                    "chunk_id": f"{file_hash}::p{page_num}::c{idx}",
+                    "metadata": {
+                        "file_hash": file_hash,
+                        "page": page_num,
+                        "chunk_index": idx
+                    }
+                })
+        
+        extracted_data["chunks"] = all_chunks
+        extracted_data["total_chunks"] = len(all_chunks)
+        
+        return extracted_data
 
 # Create global instance
 pdf_parser = OptimizedPDFParser()
@@ -0,0 +1,110 @@
+# app/services/prompts.py
+# Static instructions come first and the document text last, so every prompt of
+# a kind shares a byte-identical prefix the inference provider can prefix-cache.
+from functools import lru_cache
+from typing import List, Tuple
+
+SUMMARY_PROMPT = """Analyze the following legal document and provide a comprehensive summary.
+
+Please provide a structured summary with:
+1. Document Type and Purpose
+2. Key Parties Involved
+3. Main Terms and Conditions
+4. Important Deadlines or Dates
+5. Financial Obligations
+6. Termination Conditions"""
+
+SIMPLIFY_PROMPT = """Analyze the entire legal document provided below. Your task is to "translate" it into plain English. Create a structured summary with the following markdown sections:
+
+### 🔑 Key Terms
+(Define important terms like 'Lessee', 'Force Majeure', etc.)
+
+### ✅ Your Obligations
+(A bulleted list of everything the user MUST do.)
+
+### ⚠️ Potential Risks & Red Flags
+(A bulleted list of penalties, auto-renewals, or unfair terms.)
+
+### 📈 Financial Summary
+(List all costs, deposits, and fees mentioned.)
+
+### 📅 Important Dates
+(All deadlines, renewal dates, and time-sensitive items.)"""
+
+COMPARE_PROMPT = """You are a legal analyst. Compare and contrast the clauses from different documents given below. Explain the key differences in simple terms.
+
+Structure the analysis with these sections:
+### Key Similarities
+### Key Differences
+### Recommendations
+### Risk Assessment"""
+
+RAG_PROMPT = """Based ONLY on the context from a legal document given below, please perform the following tasks:
+
+TASKS:
+1.  Direct Answer: Answer the user's question directly. If the answer isn't in the context, state 'The document does not provide an answer to this question.'
+2.  Summary: Provide a brief, simple-language summary of the provided context.
+3.  Key Clauses & Obligations: Identify and list the most important clauses, obligations, or deadlines mentioned.
+4.  Red Flags & Risks: Point out any potential red flags, risks, penalties, or unusual terms for the user.
+
+Please format your response clearly using markdown."""
+
+REPORT_PROMPTS = {
+    "financial": """Generate a confidential financial analysis report for this legal document. Focus on:
+
+1. All financial obligations and costs
+2. Payment terms and schedules
+3. Penalties and late fees
+4. Tax implications
+5. Financial risks and liabilities""",
+    "legal_risks": """Generate a confidential legal risk assessment for this document. Identify:
+
+1. Potential legal liabilities
+2. Compliance risks
+3. Contractual obligations
+4. Termination risks
+5. Dispute resolution procedures
+6. Regulatory compliance issues""",
+    "compliance": """Generate a confidential compliance analysis for this document. Assess:
+
+1. Regulatory compliance requirements
+2. Industry-specific regulations
+3. Data protection and privacy
+4. Reporting obligations
+5. Audit requirements
+6. Compliance deadlines""",
+}
+
+REPORT_TITLES = {
+    "financial": "Confidential Financial Report",
+    "legal_risks": "Confidential Legal Risk Assessment",
+    "compliance": "Confidential Compliance Report",
+}
+
+
+def build_summary_prompt(full_text: str) -> str:
+    return f"{SUMMARY_PROMPT}\n\nDocument:\n{full_text}\n\nSummary:"
+
+
+def build_simplify_prompt(full_text: str) -> str:
+    return f"{SIMPLIFY_PROMPT}\n\nDocument Text:\n{full_text}\n\nStructured Analysis:"
+
+
+def build_compare_prompt(clause_query: str, comparison_text: str) -> str:
+    return f"{COMPARE_PROMPT}\n\nQuery: \"{clause_query}\"\n\n{comparison_text}\n\nComparison Analysis:"
+
+
+def build_report_prompt(report_type: str, full_text: str) -> str:
+    """Raises KeyError for an unknown report_type."""
+    return f"{REPORT_PROMPTS[report_type]}\n\nDocument: {full_text}\n\n{REPORT_TITLES[report_type]}:"
+
+
+@lru_cache(maxsize=512)
+def _rag_prompt(question: str, snippets: Tuple[str, ...]) -> str:
+    context = "\n\n".join(snippets)
+    return f"{RAG_PROMPT}\n\nCONTEXT:\n---\n{context}\n---\n\nUSER'S QUESTION: \"{question}\""
+
+
+def build_rag_prompt(question: str, snippets: List[str]) -> str:
+    """Cached per (question, snippets): repeated questions on a file retrieve the same chunks."""
+    return _rag_prompt(question, tuple(snippets))
@@ -1,8 +1,36 @@
+import fcntl
 import os
-import json
+import sys
+import orjson
+import subprocess
+from typing import List, Optional
 from app.database import firestore_db
 from app.config import settings
 
+# Trainers started by this worker, kept only so finished ones get reaped
+_running_jobs: List[subprocess.Popen] = []
+
+
+def _reap_finished_jobs() -> None:
+    _running_jobs[:] = [job for job in _running_jobs if job.poll() is None]
+
+
+def _acquire_user_lock(user_id: str) -> Optional[int]:
+    """
+    Take the user's retrain lock and return its fd, or None if a job holds it.
+    flock is shared by every worker process, and the kernel drops it when the
+    last holder exits, so a crashed trainer never leaves a stale lock.
+    """
+    lock_dir = os.path.dirname(settings.RETRAIN_DATASET_PATH)
+    os.makedirs(lock_dir, exist_ok=True)
+    fd = os.open(os.path.join(lock_dir, f"retrain_{user_id}.lock"), os.O_CREAT | os.O_WRONLY, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
 
 def build_retrain_dataset_for_user(user_id: str) -> str:
     """Build a JSONL dataset from feedback belonging to a specific user."""
@@ -10,33 +38,56 @@ def build_retrain_dataset_for_user(user_id: str) -> str:
         firestore_db
         .collection("feedback")
         .where("user_id", "==", user_id)
+        .select(["corrected_output", "chunk_id"])  # Skip the rest of each feedback document
         .stream()
     )
 
-    dataset = []
-    for doc in feedback_docs:
-        data = doc.to_dict()
-        # Use file_hash consistently; include minimal prompt structure
-        corrected = data.get("corrected_output")
-        chunk_id = data.get("chunk_id")
-        if corrected and chunk_id:
-            dataset.append({
-                "prompt": f"Improve answer for chunk {chunk_id} based on legal context:",
-                "completion": corrected
-            })
-
-    # Persist dataset
+    # Write rows as Firestore streams them, so memory stays flat however much feedback there is
     os.makedirs(os.path.dirname(settings.RETRAIN_DATASET_PATH), exist_ok=True)
     dataset_path = settings.RETRAIN_DATASET_PATH.replace(".jsonl", f"_{user_id}.jsonl")
-    with open(dataset_path, "w", encoding="utf-8") as f:
-        for entry in dataset:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    with open(dataset_path, "wb", buffering=1 << 20) as f:
+        for doc in feedback_docs:
+            data = doc.to_dict()
+            # Use file_hash consistently; include minimal prompt structure
+            corrected = data.get("corrected_output")
+            chunk_id = data.get("chunk_id")
+            if corrected and chunk_id:
+                # orjson writes UTF-8 bytes directly (no ASCII escaping, like ensure_ascii=False)
+                f.write(orjson.dumps({
+                    "prompt": f"Improve answer for chunk {chunk_id} based on legal context:",
+                    "completion": corrected
+                }) + b"\n")
 
     return dataset_path
 
 
-def trigger_retrain_for_user(user_id: str) -> None:
-    """Trigger a user-scoped retrain job using LoRA script with provided dataset."""
-    dataset_path = build_retrain_dataset_for_user(user_id)
-    # This call should ideally be delegated to a job runner
-    os.system(f"python retrain/train_lora.py --user_id {user_id} --dataset_path {dataset_path}")
+def trigger_retrain_for_user(user_id: str) -> Optional[int]:
+    """
+    Start a user-scoped LoRA retrain on the built dataset and return its PID,
+    without waiting for it. Returns None if that user's previous job is still
+    running in any worker.
+    """
+    _reap_finished_jobs()
+    lock_fd = _acquire_user_lock(user_id)
+    if lock_fd is None:
+        print(f"Retrain for {user_id} already running")
+        return None
+
+    try:
+        # One dataset and log per user: holding the lock means no trainer is reading them
+        dataset_path = build_retrain_dataset_for_user(user_id)
+        log_path = dataset_path.replace(".jsonl", ".log")
+        # No shell, and the trainer gets its own session so it outlives a worker restart.
+        # It inherits the lock fd and holds the lock until it exits.
+        # This should ideally be delegated to a job runner.
+        with open(log_path, "wb") as log:  # Latest run only
+            job = subprocess.Popen(
+                [sys.executable, "retrain/train_lora.py", "--user_id", user_id, "--dataset_path", dataset_path],
+                stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                close_fds=True, pass_fds=(lock_fd,), start_new_session=True,
+            )
+    finally:
+        # The trainer has its own reference now; on failure this releases the lock
+        os.close(lock_fd)
+    _running_jobs.append(job)
+    return job.pid
@@ -0,0 +1,76 @@
+# app/services/summary.py
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+from app.database import firestore_db, SERVER_TIMESTAMP, document_is_completed
+from app.services.embedding import aget_document_text
+from app.services.inference import acall_hf_inference
+from app.services.prompts import build_summary_prompt
+from app.utils.coalescer import RequestCoalescer
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_COLLECTION = "summaries"
+SUMMARY_TOP_K = 20  # Chunks fed into the summary prompt
+
+# Firestore holds the summaries; this only lets concurrent cold requests share one LLM call
+_summary_coalescer = RequestCoalescer(ttl=0)
+
+
+async def get_stored_summary(file_hash: str) -> Optional[Dict[str, Any]]:
+    """Return the stored summary for a document, or None if none has been computed yet."""
+    cached = await asyncio.to_thread(firestore_db.collection(SUMMARY_COLLECTION).document(file_hash).get)
+    if not cached.exists:
+        return None
+    data = cached.to_dict()
+    return {"summary": data.get("summary"), "confidence": data.get("confidence", 0.0)}
+
+
+async def _load_or_compute_summary(file_hash: str) -> Optional[Dict[str, Any]]:
+    stored = await get_stored_summary(file_hash)
+    if stored is not None:
+        return stored
+
+    # Read before the chunks: a summary of a document still being ingested only
+    # covers the chunks stored so far, so it is returned but not persisted
+    completed = await asyncio.to_thread(document_is_completed, file_hash)
+    full_text = await aget_document_text(file_hash, max_chunks=SUMMARY_TOP_K)
+    if not full_text:
+        return None
+
+    prompt = build_summary_prompt(full_text)
+    answer, confidence = await acall_hf_inference(prompt)
+
+    # Failed LLM calls come back with zero confidence and are not persisted
+    if confidence > 0 and completed:
+        summary_ref = firestore_db.collection(SUMMARY_COLLECTION).document(file_hash)
+        await asyncio.to_thread(summary_ref.set, {
+            "summary": answer,
+            "confidence": confidence,
+            "computed_at": SERVER_TIMESTAMP,
+        })
+    return {"summary": answer, "confidence": confidence}
+
+
+async def get_or_create_summary(file_hash: str) -> Optional[Dict[str, Any]]:
+    """
+    Return the stored summary for a document, generating and storing it on the
+    first request. Returns None when the document has no indexed chunks.
+    """
+    return await _summary_coalescer.run(file_hash, lambda: _load_or_compute_summary(file_hash))
+
+
+async def precompute_summary(file_hash: str) -> Optional[Dict[str, Any]]:
+    """
+    Generate and store the summary once ingestion has completed. Bypasses the
+    coalescer so it never joins an in-flight request built from partial chunks.
+    """
+    return await _load_or_compute_summary(file_hash)
+
+
+def delete_summary(file_hash: str) -> None:
+    """Drop the stored summary, e.g. when its document is deleted."""
+    try:
+        firestore_db.collection(SUMMARY_COLLECTION).document(file_hash).delete()
+    except Exception as e:
+        logger.warning(f"Could not delete summary for {file_hash}: {e}")
@@ -0,0 +1,54 @@
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, Optional
+from cachetools import TTLCache
+
+_MISSING = object()
+
+
+class RequestCoalescer:
+    """
+    Let concurrent callers with the same key share one in-flight computation,
+    and keep its result for a short TTL so immediate repeats skip it entirely.
+    Intended for a single event loop (one per worker process).
+    """
+
+    def __init__(self, ttl: float = 60, maxsize: int = 1024,
+                 cacheable: Optional[Callable[[Any], bool]] = None):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._results = TTLCache(maxsize=maxsize, ttl=ttl) if ttl > 0 else None
+        self._cacheable = cacheable
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        return hashlib.blake2b("|".join(str(p) for p in parts).encode(), digest_size=16).hexdigest()
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        if self._results is not None:
+            cached = self._results.get(key, _MISSING)
+            if cached is not _MISSING:
+                return cached
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, key=key: self._finish(key, t))
+
+        # Shield so one caller disconnecting does not cancel the work for the others
+        return await asyncio.shield(task)
+
+    def invalidate(self, key: str) -> None:
+        if self._results is not None:
+            self._results.pop(key, None)
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        self._inflight.pop(key, None)
+        if task.cancelled():
+            return
+        # Reading the exception also marks it retrieved when no caller is left waiting
+        if task.exception() is not None or self._results is None:
+            return
+        result = task.result()
+        if self._cacheable is None or self._cacheable(result):
+            self._results[key] = result
@@ -1,12 +1,87 @@
 import os
 import uuid
+import asyncio
+import hashlib
+import logging
+from typing import Tuple
+from fastapi import UploadFile
 from app.config import settings
 
+try:
+    import blake3  # optional: pip install blake3
+except ImportError:
+    blake3 = None
+
+logger = logging.getLogger(__name__)
+
 os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
 
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+
+class FileTooLargeError(ValueError):
+    """Raised when an upload exceeds the configured size limit."""
+
+
+def new_file_hasher():
+    """
+    Hasher used for file-dedup keys. BLAKE3 (SIMD, multi-threaded) when
+    FILE_HASH_ALGORITHM=blake3 and the wheel is installed, otherwise SHA-256
+    through OpenSSL, which uses the CPU's SHA extensions where available.
+    """
+    if settings.FILE_HASH_ALGORITHM == "blake3":
+        if blake3 is not None:
+            return blake3.blake3(max_threads=blake3.blake3.AUTO)
+        logger.warning("FILE_HASH_ALGORITHM=blake3 but the blake3 package is missing; using sha256")
+    return hashlib.sha256()
+
+
+def file_hash_hexdigest(hasher) -> str:
+    """
+    Final dedup key for a new_file_hasher(). BLAKE3 keys carry a "b3_" prefix so
+    they can never collide with the SHA-256 ids of documents uploaded before a switch.
+    """
+    prefix = "b3_" if hasher.name == "blake3" else ""
+    return prefix + hasher.hexdigest()
+
+
 def save_upload(content: bytes, original_name: str) -> str:
     file_id = f"{uuid.uuid4()}.pdf"
     path = os.path.join(settings.UPLOAD_DIR, file_id)
     with open(path, "wb") as f:
         f.write(content)
-    return file_id
\ No newline at end of file
+    return file_id
+
+
+def temp_upload_path() -> str:
+    """Unique scratch path inside UPLOAD_DIR (same filesystem, so a later rename is atomic)."""
+    return os.path.join(settings.UPLOAD_DIR, f".{uuid.uuid4().hex}.part")
+
+
+def _hash_and_write(hasher, f, chunk: bytes) -> None:
+    hasher.update(chunk)
+    f.write(chunk)
+
+
+async def stream_upload_to_disk(upload: UploadFile, dest_path: str, max_bytes: int) -> Tuple[str, int]:
+    """
+    Copy an upload to dest_path in fixed-size chunks while hashing it, so the
+    whole body is never held in memory. Returns (hexdigest, size).
+    The partial file is removed if the size limit is exceeded.
+    """
+    hasher = new_file_hasher()
+    size = 0
+    try:
+        with open(dest_path, "wb") as f:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise FileTooLargeError(f"Upload exceeds {max_bytes} bytes")
+                # Hashing and the disk write go to a worker thread (hashlib and blake3
+                # release the GIL on large buffers) so the loop keeps serving requests
+                await asyncio.to_thread(_hash_and_write, hasher, f, chunk)
+    except BaseException:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+    return file_hash_hexdigest(hasher), size
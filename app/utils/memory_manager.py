@@ -1,11 +1,45 @@
 import psutil
+import atexit
+import bisect
 import gc
 import logging
-from typing import Optional
+import threading
+import time
+from enum import IntEnum
+from typing import List, Optional
 import os
 
 logger = logging.getLogger(__name__)
 
+class RecCode(IntEnum):
+    """Memory recommendation codes; see format_recommendations for the text."""
+    REDUCE_BATCH = 1
+    HIGH = 2
+    LOW_SYS = 3
+    CRITICAL = 4
+
+_REC_TEXT = {
+    RecCode.REDUCE_BATCH: "Consider reducing batch sizes for PDF processing",
+    RecCode.HIGH: "Memory usage is high - consider processing smaller files",
+    RecCode.LOW_SYS: "System memory is low - consider closing other applications",
+    RecCode.CRITICAL: "Critical memory usage - consider restarting the service",
+}
+
+# (RSS MB above which it applies, code), sorted by threshold
+_RSS_RECOMMENDATIONS = [
+    (800, RecCode.REDUCE_BATCH),
+    (1000, RecCode.HIGH),
+    (1500, RecCode.CRITICAL),
+]
+_RSS_THRESHOLDS = [threshold for threshold, _ in _RSS_RECOMMENDATIONS]
+LOW_SYSTEM_MEMORY_MB = 500
+
+_MB = 1.0 / (1 << 20)  # bytes -> MB in one multiply
+
+USAGE_CACHE_SECONDS = 0.05
+CLEANUP_COOLDOWN_SECONDS = 5.0
+CLEANUP_GROWTH_MB = 100  # Growth since the last cleanup that overrides the cooldown
+
 class MemoryManager:
     def __init__(self, memory_threshold_mb: int = 1000):
         """
@@ -15,28 +49,120 @@ class MemoryManager:
             memory_threshold_mb: Memory threshold in MB before cleanup is triggered
         """
         self.memory_threshold_mb = memory_threshold_mb
+        # Ingestion allocates many short-lived objects; a higher gen-0 threshold
+        # amortizes automatic collections so cleanup rarely needs forcing
+        gc.set_threshold(50_000, 50, 50)
         self.process = psutil.Process(os.getpid())
+        # Installed RAM does not change; only free memory needs re-reading
+        self._total_ram = psutil.virtual_memory().total
+        self._available_ttl = 0.5  # seconds between /proc/meminfo reads
+        self._available = 0
+        self._available_read_at = float("-inf")
+        # Latest sample from the background sampler; rebinding a dict is atomic
+        self._last_sample: Optional[dict] = None
+        self._sampler: Optional[threading.Thread] = None
+        # Without the sampler, reads within USAGE_CACHE_SECONDS of each other share one sample
+        self._cache_ts = float("-inf")
+        self._cache_val: dict = {}
+        self._stop_sampling = threading.Event()
+        # When the last forced cleanup ran and the RSS it left behind
+        self._last_cleanup_ts = float("-inf")
+        self._last_cleanup_rss = 0.0
     
     def get_memory_usage(self) -> dict:
         """
-        Get current memory usage information.
+        Get current memory usage information. While the sampler runs this is
+        its latest sample (no I/O); otherwise the process is read now.
         
         Returns:
             Dictionary with memory usage details
         """
+        sample = self._last_sample
+        if sample is not None:
+            return sample
+        now = time.monotonic()
+        if now - self._cache_ts < USAGE_CACHE_SECONDS:
+            return self._cache_val
+        sample = self._sample()
+        if sample:
+            self._cache_ts, self._cache_val = now, sample
+        return sample
+    
+    def start_sampler(self, interval: float = 0.25) -> None:
+        """
+        Sample memory usage every `interval` seconds on a daemon thread, so
+        callers on the request path read the latest values without touching procfs.
+        """
+        if self._sampler is not None and self._sampler.is_alive():
+            return
+        self._stop_sampling.clear()
+        self._last_sample = self._sample()
+        self._sampler = threading.Thread(
+            target=self._run_sampler, args=(interval,), name="memory-sampler", daemon=True
+        )
+        self._sampler.start()
+        atexit.register(self.stop_sampler)
+    
+    def stop_sampler(self) -> None:
+        self._stop_sampling.set()
+        if self._sampler is not None:
+            self._sampler.join(timeout=1)
+            self._sampler = None
+        self._last_sample = None
+    
+    def _run_sampler(self, interval: float) -> None:
+        while not self._stop_sampling.wait(interval):
+            sample = self._sample()
+            if sample:
+                self._last_sample = sample
+    
+    def _sample(self) -> dict:
         try:
-            memory_info = self.process.memory_info()
-            memory_percent = self.process.memory_percent()
-            
-            return {
-                "rss_mb": memory_info.rss / 1024 / 1024,  # Resident Set Size in MB
-                "vms_mb": memory_info.vms / 1024 / 1024,  # Virtual Memory Size in MB
-                "percent": memory_percent,
-                "available_system_mb": psutil.virtual_memory().available / 1024 / 1024
-            }
+            # One parse of the process's /proc files for every value read inside
+            with self.process.oneshot():
+                memory_info = self.process.memory_info()
         except Exception as e:
             logger.error(f"Error getting memory usage: {e}")
             return {}
+        
+        return {
+            "rss_mb": memory_info.rss * _MB,  # Resident Set Size in MB
+            "vms_mb": memory_info.vms * _MB,  # Virtual Memory Size in MB
+            "percent": memory_info.rss / self._total_ram * 100,
+            "available_system_mb": self._available_system_bytes() * _MB
+        }
+    
+    def fast_snapshot(self) -> dict:
+        """
+        RSS, thread count and open file descriptors from a single oneshot() block.
+        Use this instead of calling several psutil.Process methods separately.
+        
+        Returns:
+            Dictionary with rss_mb, num_threads and num_fds (None where unsupported)
+        """
+        try:
+            with self.process.oneshot():
+                rss = self.process.memory_info().rss
+                num_threads = self.process.num_threads()
+                # num_fds is POSIX-only
+                num_fds = self.process.num_fds() if hasattr(self.process, "num_fds") else None
+        except Exception as e:
+            logger.error(f"Error getting process snapshot: {e}")
+            return {}
+        
+        return {
+            "rss_mb": rss * _MB,
+            "num_threads": num_threads,
+            "num_fds": num_fds
+        }
+    
+    def _available_system_bytes(self) -> int:
+        """System-wide available memory, re-read at most every _available_ttl seconds."""
+        now = time.monotonic()
+        if now - self._available_read_at > self._available_ttl:
+            self._available = psutil.virtual_memory().available
+            self._available_read_at = now
+        return self._available
     
     def is_memory_critical(self) -> bool:
         """
@@ -57,20 +183,23 @@ class MemoryManager:
             True if cleanup was successful
         """
         try:
-            # Force garbage collection
-            collected = gc.collect()
-            
-            # Get memory before and after
-            memory_before = self.get_memory_usage()
-            
-            # Additional cleanup steps
-            gc.collect(2)  # More aggressive collection
-            
-            memory_after = self.get_memory_usage()
-            
-            logger.info(f"Memory cleanup: collected {collected} objects")
-            logger.info(f"Memory before: {memory_before.get('rss_mb', 0):.2f} MB")
-            logger.info(f"Memory after: {memory_after.get('rss_mb', 0):.2f} MB")
+            # A single full collection; a gen-2 pass already covers the younger generations
+            collected = gc.collect(2)
+            self._last_cleanup_ts = time.monotonic()
+            if collected:
+                memory_after = self._sample()
+                if memory_after:
+                    self._cache_ts, self._cache_val = self._last_cleanup_ts, memory_after
+            else:
+                # Nothing freed, so the latest reading (usually the one that
+                # triggered this cleanup) still holds
+                memory_after = self.get_memory_usage()
+            self._last_cleanup_rss = memory_after.get("rss_mb", 0)
+            if collected:
+                logger.info(
+                    f"Memory cleanup: collected {collected} objects, "
+                    f"{self._last_cleanup_rss:.2f} MB after"
+                )
             
             return True
             
@@ -93,10 +222,16 @@ class MemoryManager:
             
             logger.info(f"Memory usage during {operation_name}: {memory_info.get('rss_mb', 0):.2f} MB")
             
-            # Check if cleanup is needed
-            if self.is_memory_critical():
-                logger.warning(f"Memory usage critical during {operation_name}, triggering cleanup")
-                self.force_cleanup()
+            # Check if cleanup is needed; under sustained pressure a full sweep runs at most
+            # every CLEANUP_COOLDOWN_SECONDS unless RSS grew CLEANUP_GROWTH_MB since the last one
+            rss_mb = memory_info.get("rss_mb", 0)
+            if rss_mb > self.memory_threshold_mb:
+                if (time.monotonic() - self._last_cleanup_ts > CLEANUP_COOLDOWN_SECONDS
+                        or rss_mb - self._last_cleanup_rss > CLEANUP_GROWTH_MB):
+                    logger.warning(f"Memory usage critical during {operation_name}, triggering cleanup")
+                    self.force_cleanup()
+                else:
+                    logger.debug(f"Memory cleanup suppressed during {operation_name} (cooldown)")
             
             return memory_info
             
@@ -104,36 +239,41 @@ class MemoryManager:
             logger.error(f"Error monitoring memory during {operation_name}: {e}")
             return None
     
-    def get_memory_recommendations(self) -> list:
+    def get_memory_recommendations(self) -> List[RecCode]:
         """
         Get memory optimization recommendations.
         
         Returns:
-            List of recommendation strings
+            List of recommendation codes; format_recommendations turns them into text
         """
-        recommendations = []
         memory_info = self.get_memory_usage()
         
         rss_mb = memory_info.get("rss_mb", 0)
         available_system_mb = memory_info.get("available_system_mb", 0)
+        system_low = available_system_mb < LOW_SYSTEM_MEMORY_MB
         
-        if rss_mb > 800:
-            recommendations.append("Consider reducing batch sizes for PDF processing")
-        
-        if rss_mb > 1000:
-            recommendations.append("Memory usage is high - consider processing smaller files")
-        
-        if available_system_mb < 500:
-            recommendations.append("System memory is low - consider closing other applications")
-        
-        if rss_mb > 1500:
-            recommendations.append("Critical memory usage - consider restarting the service")
+        # Every RSS threshold strictly below rss_mb applies
+        exceeded = bisect.bisect_left(_RSS_THRESHOLDS, rss_mb)
+        if not exceeded and not system_low:
+            return []
         
+        recommendations = [code for _, code in _RSS_RECOMMENDATIONS[:exceeded]]
+        if system_low:
+            # Listed before the critical-usage advice
+            recommendations.insert(min(exceeded, 2), RecCode.LOW_SYS)
         return recommendations
 
-# Global memory manager instance
-memory_manager = MemoryManager()
+def format_recommendations(codes: List[RecCode]) -> List[str]:
+    """Human-readable text for recommendation codes, for the presentation layer."""
+    return [_REC_TEXT[code] for code in codes]
+
+# Global memory manager instance, created on first use so importing this module
+# does not build a psutil.Process and read procfs in every worker
+memory_manager: Optional[MemoryManager] = None
 
 def get_memory_manager() -> MemoryManager:
     """Get the global memory manager instance."""
+    global memory_manager
+    if memory_manager is None:
+        memory_manager = MemoryManager()
     return memory_manager
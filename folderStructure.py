@@ -1,4 +1,5 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 # Define the base directory
 base_dir = "Backend_legalDocAI"
@@ -54,13 +55,20 @@ if not os.path.exists(base_dir):
 # Change to the base directory
 os.chdir(base_dir)
 
-# Create folders
-for folder in folders_to_create:
+# Create folders, including every parent a file needs, once each
+dirs = {os.path.dirname(f) for f in files_to_create if os.path.dirname(f)} | set(folders_to_create)
+for folder in sorted(dirs):
     os.makedirs(folder, exist_ok=True)
 
-# Create files
-for file in files_to_create:
-    with open(file, 'w') as f:
-        pass  # Create an empty file
+# Create files: exclusive create leaves existing files untouched (works on every OS)
+def create_empty_file(path):
+    try:
+        open(path, "x").close()
+    except FileExistsError:
+        pass
+
+# Paths are disjoint and their directories exist, so the creates can overlap
+with ThreadPoolExecutor(max_workers=8) as pool:
+    list(pool.map(create_empty_file, files_to_create))
 
 print("Folder structure and files created successfully.")
\ No newline at end of file
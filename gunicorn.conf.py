@@ -0,0 +1,40 @@
+# gunicorn.conf.py
+# Usage: gunicorn -c gunicorn.conf.py app.app:app
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+# UvicornWorker picks uvloop + httptools automatically when uvicorn[standard] is installed
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Passed to uvicorn as timeout_keep_alive; keeps connections from chatty QA clients
+# open between requests (above the 60s idle timeout of most load balancers)
+keepalive = int(os.getenv("KEEPALIVE", "75"))
+
+# Import the app (embedder weights, Firebase/Chroma clients) once in the master;
+# forked workers share the read-only model pages copy-on-write instead of each loading them
+preload_app = True
+
+# CUDA cannot be initialised before fork, so the master keeps the embedder on
+# CPU and every worker moves/warms it in post_fork. Set GUNICORN_PREFORK_CUDA=1
+# to place it in the master instead (CPU-only setups).
+if os.getenv("GUNICORN_PREFORK_CUDA") != "1":
+    os.environ.setdefault("EMBEDDING_DEFER_DEVICE_PLACEMENT", "true")
+
+
+def when_ready(server):
+    import gc
+
+    # Runs in the master after the preload and before any fork: frozen objects
+    # are skipped by the workers' collections, so GC never writes to (and
+    # copy-on-write duplicates) the pages they share with the master
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from app.database import connect_vector_store, prepare_embedder
+
+    # The master's Chroma client holds live keep-alive sockets; give each worker its own
+    connect_vector_store()
+    if os.getenv("GUNICORN_PREFORK_CUDA") != "1":
+        prepare_embedder()
@@ -6,28 +6,61 @@ Script to restore connection to existing ChromaDB Cloud collection
 import chromadb
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Add the app directory to Python path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
 
 from app.config import settings
 
-def restore_chroma_connection():
-    """Restore connection to existing ChromaDB Cloud collection"""
-    try:
-        print("=== Restoring ChromaDB Cloud Connection ===\n")
-        
+# Per-collection document counts cost one Cloud round-trip each; opt in with CHROMA_VERBOSE=1
+VERBOSE = os.getenv("CHROMA_VERBOSE") == "1"
+
+# One client (TLS handshake + auth) and collection handle shared by both checks
+_CLIENT = None
+_COLLECTION = None
+
+def _get_client():
+    """Configure the Cloud connection and create the client on first use."""
+    global _CLIENT
+    if _CLIENT is None:
         # Set environment variables for ChromaDB Cloud
         os.environ["CHROMA_SERVER_HOST"] = settings.CHROMA_CLOUD_HOST
         os.environ["CHROMA_SERVER_HTTP_PORT"] = "443"
         os.environ["CHROMA_SERVER_SSL_ENABLED"] = "true"
         os.environ["CHROMA_AUTH_CREDENTIALS"] = settings.CHROMA_CLOUD_API_KEY
+        _CLIENT = chromadb.Client()
+    return _CLIENT
+
+def _get_collection():
+    """The legal_chunks collection, resolved once."""
+    global _COLLECTION
+    if _COLLECTION is None:
+        _COLLECTION = _get_client().get_collection(name="legal_chunks")
+    return _COLLECTION
+
+def _count_collections(collections):
+    """Count every collection concurrently so the wait is the slowest round-trip, not the sum."""
+    counts = {}
+    with ThreadPoolExecutor(max_workers=min(8, len(collections))) as pool:
+        futures = {pool.submit(col.count): col.name for col in collections}
+        for future in as_completed(futures):
+            try:
+                counts[futures[future]] = future.result()
+            except Exception as e:
+                counts[futures[future]] = e
+    return counts
+
+def restore_chroma_connection():
+    """Restore connection to existing ChromaDB Cloud collection"""
+    try:
+        print("=== Restoring ChromaDB Cloud Connection ===\n")
         
         print(f"Connecting to: {settings.CHROMA_CLOUD_HOST}")
         print(f"API Key: {settings.CHROMA_CLOUD_API_KEY[:20]}...")
         
         # Create client
-        client = chromadb.Client()
+        client = _get_client()
         print("✅ ChromaDB Cloud client created")
         
         # List all collections to see what's available
@@ -35,13 +68,15 @@ def restore_chroma_connection():
         try:
             collections = client.list_collections()
             print(f"Found {len(collections)} collections:")
+            counts = _count_collections(collections) if VERBOSE and collections else {}
             for col in collections:
                 print(f"  - {col.name} (ID: {col.id})")
-                try:
-                    count = col.count()
-                    print(f"    Documents: {count}")
-                except Exception as e:
-                    print(f"    Could not count: {e}")
+                if col.name in counts:
+                    count = counts[col.name]
+                    if isinstance(count, Exception):
+                        print(f"    Could not count: {count}")
+                    else:
+                        print(f"    Documents: {count}")
         except Exception as e:
             print(f"❌ Could not list collections: {e}")
             return False
@@ -49,7 +84,7 @@ def restore_chroma_connection():
         # Try to get the legal_chunks collection
         print("\n2. Connecting to legal_chunks collection...")
         try:
-            collection = client.get_collection(name="legal_chunks")
+            collection = _get_collection()
             print("✅ Successfully connected to legal_chunks collection")
             
             # Count documents
@@ -104,28 +139,21 @@ def test_specific_file_query(file_hash: str):
     try:
         print(f"\n=== Testing Query for File: {file_hash} ===\n")
         
-        # Set environment variables
-        os.environ["CHROMA_SERVER_HOST"] = settings.CHROMA_CLOUD_HOST
-        os.environ["CHROMA_SERVER_HTTP_PORT"] = "443"
-        os.environ["CHROMA_SERVER_SSL_ENABLED"] = "true"
-        os.environ["CHROMA_AUTH_CREDENTIALS"] = settings.CHROMA_CLOUD_API_KEY
+        collection = _get_collection()
         
-        client = chromadb.Client()
-        collection = client.get_collection(name="legal_chunks")
-        
-        # Query with file filter
+        # Metadata filter only: no query embedding or ANN search needed to list a file's chunks
         print("Querying for specific file...")
-        results = collection.query(
-            query_texts=["contract"],
-            n_results=10,
-            where={"file_hash": file_hash}
+        results = collection.get(
+            where={"file_hash": file_hash},
+            limit=10,
+            include=["documents", "metadatas"]
         )
         
-        if results["documents"] and results["documents"][0]:
-            print(f"✅ Found {len(results['documents'][0])} chunks for file {file_hash}")
+        if results["documents"]:
+            print(f"✅ Found {len(results['documents'])} chunks for file {file_hash}")
             
             # Show chunk details
-            for i, (doc, meta) in enumerate(zip(results["documents"][0], results["metadatas"][0])):
+            for i, (doc, meta) in enumerate(zip(results["documents"], results["metadatas"])):
                 print(f"\nChunk {i+1}:")
                 print(f"  Page: {meta.get('page', 'N/A')}")
                 print(f"  Length: {len(doc)} chars")
@@ -141,10 +169,15 @@ def test_specific_file_query(file_hash: str):
         return False
 
 if __name__ == "__main__":
+    # Block-buffer stdout so each phase's diagnostics go out in one write
+    # instead of one per print(); flushed at phase boundaries below
+    sys.stdout.reconfigure(line_buffering=False, write_through=False)
+
     print("=== ChromaDB Cloud Connection Restore ===\n")
     
     # Test basic connection
     connection_ok = restore_chroma_connection()
+    sys.stdout.flush()
     
     if connection_ok:
         print("\n✅ ChromaDB Cloud connection restored successfully!")
@@ -152,6 +185,7 @@ if __name__ == "__main__":
         # Test specific file query
         file_hash = "8bceeb2b84f0283f5273b0330a16b5b2725bfcb2792db6bd9fa1ccf8d4336c52"
         test_specific_file_query(file_hash)
+        sys.stdout.flush()
         
         print("\n🎉 You can now restart your server and it should work!")
     else:
@@ -1,5 +1,9 @@
 # backend/retrain/merge_lora.py
-import json, torch
+import torch
+try:
+    import orjson
+except ImportError:
+    import json as orjson  # json.loads also accepts bytes
 from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
 from peft import PeftModel
 
@@ -7,16 +11,21 @@ CFG_PATH = "./retrain/config.json"
 OUT_MERGED = "./retrain/lora_model_merged"
 
 def main():
-    cfg = json.load(open(CFG_PATH))
+    with open(CFG_PATH, "rb") as f:
+        cfg = orjson.loads(f.read())
     base = cfg["base_model"]
     adapters = cfg["output_dir"]           # ./retrain/lora_model
 
     tok = AutoTokenizer.from_pretrained(base)
-    base_model = AutoModelForSeq2SeqLM.from_pretrained(base)
+    # bf16 straight from the checkpoint halves peak RAM; low_cpu_mem_usage skips
+    # the randomly initialised copy that from_pretrained would otherwise build
+    base_model = AutoModelForSeq2SeqLM.from_pretrained(
+        base, torch_dtype=torch.bfloat16, low_cpu_mem_usage=True
+    )
     model = PeftModel.from_pretrained(base_model, adapters)
     model = model.merge_and_unload()       # merges LoRA into base weights
 
-    model.save_pretrained(OUT_MERGED)
+    model.save_pretrained(OUT_MERGED, safe_serialization=True, max_shard_size="2GB")
     tok.save_pretrained(OUT_MERGED)
     print("Merged model saved to", OUT_MERGED)
 